@@ -0,0 +1,196 @@
+# backend/app/core/cache.py
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Sentinela para diferenciar "não está no cache" de um valor None armazenado
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU em memória, thread-safe, com expiração opcional por entrada.
+    Usado para evitar chamadas repetidas a serviços externos (IA, APIs, etc.).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Retorna o valor associado à chave, ou `default` se ausente/expirado."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Armazena um valor. `ttl` sobrescreve o TTL padrão do cache."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Agrupa chamadas concorrentes com a mesma chave: a primeira executa a função
+    e as demais aguardam e recebem o mesmo resultado (ou a mesma exceção).
+    Complementa o TTLCache, que só ajuda depois que a primeira chamada termina.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class PersistentCache:
+    """
+    Cache em disco (SQLite) com expiração, compartilhado entre reinícios do
+    servidor. Os valores são serializados em JSON (orjson); `namespace`
+    separa as entradas de cada serviço dentro do mesmo arquivo.
+    Linhas expiradas são apagadas periodicamente e `max_entries` limita o
+    número de entradas do namespace (as mais antigas saem primeiro).
+    Falhas do banco de cache nunca interrompem a requisição: viram cache miss.
+    """
+
+    # A limpeza roda na abertura e depois a cada N gravações
+    PURGE_EVERY = 256
+
+    def __init__(self, path: Path, namespace: str, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        try:
+            conn = sqlite3.connect(str(path), check_same_thread=False)
+            with conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS api_cache (
+                        namespace TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        expires_at REAL,
+                        payload BLOB NOT NULL,
+                        PRIMARY KEY (namespace, key)
+                    )
+                """)
+            self._conn = conn
+        except sqlite3.Error as e:
+            # Arquivo somente leitura, bloqueado ou corrompido: segue sem cache
+            logger.warning(
+                f"Cache persistente '{namespace}' desativado; falha ao abrir {path}: {e}")
+            return
+
+        with self._lock:
+            self._purge()
+
+    def _purge(self) -> None:
+        """Remove entradas expiradas e o excedente do namespace. Requer o lock."""
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM api_cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                    (time.time(),))
+                if self.max_entries is not None:
+                    # INSERT OR REPLACE gera um rowid novo: rowid menor = mais antiga
+                    self._conn.execute(
+                        "DELETE FROM api_cache WHERE namespace = ? AND rowid NOT IN ("
+                        "SELECT rowid FROM api_cache WHERE namespace = ? "
+                        "ORDER BY rowid DESC LIMIT ?)",
+                        (self.namespace, self.namespace, self.max_entries))
+        except sqlite3.Error as e:
+            logger.warning(f"Falha ao limpar o cache persistente '{self.namespace}': {e}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Retorna o valor associado à chave, ou `default` se ausente/expirado."""
+        if self._conn is None:
+            return default
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload FROM api_cache WHERE namespace = ? AND key = ? "
+                    "AND (expires_at IS NULL OR expires_at > ?)",
+                    (self.namespace, key, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Falha ao ler o cache persistente '{self.namespace}': {e}")
+            return default
+        return orjson.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Armazena um valor. `ttl` sobrescreve o TTL padrão do cache."""
+        if self._conn is None:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        # Relógio de parede: a expiração precisa valer entre reinícios
+        expires_at = time.time() + ttl if ttl is not None else None
+        try:
+            with self._lock:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO api_cache (namespace, key, expires_at, payload) "
+                        "VALUES (?, ?, ?, ?)",
+                        (self.namespace, key, expires_at, orjson.dumps(value))
+                    )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    self._purge()
+        except (sqlite3.Error, TypeError) as e:
+            logger.warning(f"Falha ao gravar no cache persistente '{self.namespace}': {e}")
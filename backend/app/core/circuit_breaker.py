@@ -0,0 +1,94 @@
+# backend/app/core/circuit_breaker.py
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Disjuntor thread-safe para serviços externos. Após `fail_max` falhas
+    consecutivas o circuito abre e as chamadas são recusadas na hora (o
+    pipeline segue para o fallback) durante `reset_timeout` segundos; depois
+    disso uma única chamada de teste decide se o circuito fecha novamente.
+
+    Também acompanha a média móvel (EWMA) da latência das chamadas bem-sucedidas
+    para derivar um timeout adaptativo, limitado por um teto fixo. Chamadas que
+    falham por lentidão elevam a média, e ao abrir o circuito ela é descartada:
+    a chamada de teste usa o teto, para não confundir serviço lento com fora do ar.
+    """
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30.0,
+                 ewma_alpha: float = 0.2):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.ewma_alpha = ewma_alpha
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._latency_ewma: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """Indica se a chamada pode ser feita agora."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            # Meio-aberto: passado o resfriamento, libera uma chamada de teste
+            if (not self._probe_in_flight
+                    and time.monotonic() - self._opened_at >= self.reset_timeout):
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuito '{self.name}' fechado: serviço respondeu novamente.")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+            if latency is not None:
+                if self._latency_ewma is None:
+                    self._latency_ewma = latency
+                else:
+                    self._latency_ewma += self.ewma_alpha * (latency - self._latency_ewma)
+
+    def record_failure(self, latency: Optional[float] = None) -> None:
+        """
+        Registra uma falha. `latency` é o tempo gasto até a falha: em um
+        timeout, indica que o timeout adaptativo ficou curto demais.
+        """
+        with self._lock:
+            self._failures += 1
+            if latency is not None and self._latency_ewma is not None:
+                self._latency_ewma = max(self._latency_ewma, latency)
+            if self._opened_at is not None:
+                # A chamada de teste falhou: reinicia o resfriamento
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+            elif self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+                # A latência de antes da falha não vale para o serviço atual
+                self._latency_ewma = None
+                logger.warning(
+                    f"Circuito '{self.name}' aberto após {self._failures} falhas "
+                    f"consecutivas; chamadas suspensas por {self.reset_timeout:.0f}s.")
+
+    def timeout(self, hard_cap: float, floor: float = 1.0) -> float:
+        """
+        Timeout adaptativo: 3x a latência típica, entre `floor` e `hard_cap`.
+        Sem histórico ou com o circuito aberto (chamada de teste), usa o teto.
+        """
+        with self._lock:
+            if self._latency_ewma is None or self._opened_at is not None:
+                return hard_cap
+            return min(hard_cap, max(floor, 3 * self._latency_ewma))
@@ -36,6 +36,12 @@ if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY não encontrada no ambiente")
 else:
     logger.info("GEMINI_API_KEY configurada corretamente")
+
+# Máximo de chamadas simultâneas ao Gemini (ajuste conforme a cota do plano)
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "15"))
+# Cota do plano do Gemini: requisições e tokens por minuto
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", "1000000"))
 # --- INÍCIO DA ATUALIZAÇÃO ---
 
 # Chaves da API Google Custom Search
@@ -84,6 +90,12 @@ if not GOOGLE_DEPLOYED_INDEX_ID:  # Adicione este bloco
 else:
     logger.info("GOOGLE_DEPLOYED_INDEX_ID configurado.")
 
+# Métrica configurada no índice: define se "distance" maior ou menor é melhor
+GOOGLE_INDEX_DISTANCE_MEASURE = os.environ.get(
+    "GOOGLE_INDEX_DISTANCE_MEASURE", "DOT_PRODUCT_DISTANCE").upper()
+# Limiar para aceitar a correspondência visual, na escala da métrica acima
+VECTOR_MATCH_THRESHOLD = float(os.environ.get("VECTOR_MATCH_THRESHOLD", "0.8"))
+
 
 # Setando a região do Google Cloud, com valor padrão
 GOOGLE_CLOUD_REGION = os.environ.get(
@@ -93,10 +105,15 @@ logger.info(f"Região do Google Cloud configurada: {GOOGLE_CLOUD_REGION}")
 # Caminhos para arquivos
 GOOGLE_KEY_PATH = BACKEND_DIR / "keys" / "vision.json"
 DB_PATH = BACKEND_DIR / "cadvision.db"
+CACHE_DIR = BACKEND_DIR / "cache"
+API_CACHE_PATH = CACHE_DIR / "api_cache.db"
 
 # Garante que o diretório do banco de dados existe
 DB_PATH.parent.mkdir(exist_ok=True, parents=True)
 
+# Garante que o diretório de cache existe
+CACHE_DIR.mkdir(exist_ok=True, parents=True)
+
 # Garante que o diretório de chaves existe
 GOOGLE_KEY_PATH.parent.mkdir(exist_ok=True, parents=True)
 
@@ -0,0 +1,34 @@
+# backend/app/core/http_client.py
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Status HTTP transitórios que justificam uma nova tentativa
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def build_session(pool_connections: int = 10, pool_maxsize: int = 10,
+                  retries: int = 3, backoff_factor: float = 0.3,
+                  headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """
+    Cria uma sessão HTTP com pool de conexões (keep-alive) e retentativas
+    automáticas para falhas transitórias. Deve ser criada uma vez por serviço
+    e reutilizada entre as chamadas.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
@@ -4,6 +4,8 @@ import sys
 from pathlib import Path
 from datetime import datetime
 
+import orjson
+
 # Criar diretório de logs
 LOG_DIR = Path(__file__).resolve().parent.parent.parent / "logs"
 LOG_DIR.mkdir(exist_ok=True)
@@ -51,24 +53,30 @@ def setup_logging():
     logging.info(f"Logging configurado. Arquivo: {LOG_FILE}")
     return LOG_FILE
 
+# Níveis aceitos por log_structured_event, resolvidos uma única vez
+_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
 # Função auxiliar para log estruturado
 def log_structured_event(service: str, event: str, data: dict, level: str = "INFO"):
     """Log estruturado para eventos importantes"""
     logger = logging.getLogger(service)
+    log_level = _LEVELS.get(level.upper())
+    # Nível desativado (ou desconhecido): nada de montar e serializar o payload
+    if log_level is None or not logger.isEnabledFor(log_level):
+        return
+
     log_data = {
         'timestamp': datetime.now().isoformat(),
         'service': service,
         'event': event,
         'data': data
     }
-    
-    message = f"EVENT: {event} - DATA: {log_data}"
-    
-    if level.upper() == "INFO":
-        logger.info(message)
-    elif level.upper() == "ERROR":
-        logger.error(message)
-    elif level.upper() == "WARNING":
-        logger.warning(message)
-    elif level.upper() == "DEBUG":
-        logger.debug(message)
\ No newline at end of file
+
+    # JSON (orjson) em vez do repr: mais barato e legível por ferramentas de log
+    message = f"EVENT: {event} - DATA: {orjson.dumps(log_data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()}"
+    logger.log(log_level, message)
@@ -0,0 +1,37 @@
+# backend/app/core/rate_limit.py
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Limitador de taxa (token bucket) thread-safe. Reabastece `rate` tokens por
+    `per` segundos, até a capacidade `rate`. `acquire` bloqueia até haver tokens,
+    suavizando rajadas antes que a API externa responda com 429.
+    """
+
+    def __init__(self, rate: float, per: float = 60.0):
+        self.capacity = float(rate)
+        self.fill_rate = rate / per
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.fill_rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Consome `tokens`, aguardando o reabastecimento se necessário."""
+        # Pedidos maiores que a capacidade nunca seriam atendidos
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.fill_rate
+            time.sleep(wait)
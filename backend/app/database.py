@@ -1,6 +1,5 @@
 # backend/app/database.py
 import sqlite3
-import threading
 from pathlib import Path
 from contextlib import contextmanager
 from typing import Generator, Optional, Any, Dict, List
@@ -13,8 +12,24 @@ logger = logging.getLogger(__name__)
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 
-# Lock para operações thread-safe
-db_lock = threading.Lock()
+# Tamanho do cache de statements preparados por conexão (o padrão do sqlite3 é 128)
+STATEMENT_CACHE_SIZE = 256
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Abre uma conexão já configurada. O banco roda em modo WAL (ver `init_db`),
+    então leitores não bloqueiam o escritor e a concorrência entre requisições
+    fica a cargo do próprio SQLite, sem um lock global no processo.
+    """
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")  # Ativar chaves estrangeiras
+    # Em WAL, NORMAL é seguro contra corrupção e evita um fsync por commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
 
 
 def get_db() -> Generator[sqlite3.Connection, None, None]:
@@ -22,15 +37,11 @@ def get_db() -> Generator[sqlite3.Connection, None, None]:
     Fornece uma conexão com o banco de dados para injeção de dependência.
     Útil para frameworks como FastAPI.
     """
-    with db_lock:
-        db = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-        db.row_factory = sqlite3.Row
-        db.execute("PRAGMA foreign_keys = ON")  # Ativar chaves estrangeiras
-
-        try:
-            yield db
-        finally:
-            db.close()
+    db = _connect()
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 @contextmanager
@@ -39,19 +50,15 @@ def get_db_connection() -> Generator[sqlite3.Connection, None, None]:
     Gerenciador de contexto para conexões com o banco de dados.
     Útil para operações específicas que não usam injeção de dependência.
     """
-    with db_lock:
-        conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-
-        try:
-            yield conn
-        except sqlite3.Error as e:
-            logger.error(f"Erro de banco de dados: {e}")
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+    conn = _connect()
+    try:
+        yield conn
+    except sqlite3.Error as e:
+        logger.error(f"Erro de banco de dados: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 
 @contextmanager
@@ -75,6 +82,8 @@ def init_db():
     """Cria e inicializa as tabelas do banco de dados se elas não existirem."""
     try:
         with get_db_connection() as conn:
+            # WAL é persistente no arquivo: basta ativá-lo uma vez na inicialização
+            conn.execute("PRAGMA journal_mode = WAL")
             cur = conn.cursor()
 
             # 1. Tabela principal de PRODUTOS - AGORA COM SKU E CATEGORIZAÇÃO EXPANDIDA
@@ -310,7 +319,6 @@ def get_processing_stats() -> Dict[str, Any]:
 def delete_product_by_id(product_id: int, db: sqlite3.Connection) -> bool:
     """Exclui um produto pelo seu ID. Retorna True se bem-sucedido, False caso contrário."""
     try:
-        # O 'with db_lock:' FOI REMOVIDO DAQUI
         cursor = db.cursor()
         cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
         db.commit()
@@ -326,7 +334,6 @@ def delete_product_by_id(product_id: int, db: sqlite3.Connection) -> bool:
 def get_all_products(db: sqlite3.Connection) -> List[Dict]:
     """Recupera TODOS os produtos do banco de dados."""
     try:
-        # O 'with db_lock:' FOI REMOVIDO DAQUI
         cursor = db.cursor()
         cursor.execute("SELECT * FROM products ORDER BY id DESC")
         return [dict(row) for row in cursor.fetchall()]
@@ -3,8 +3,11 @@ from pydantic import BaseModel, Field, validator, HttpUrl
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 import re
 
+from app.utils import fold_accents
+
 
 class ProductCategory(str, Enum):
     """Categorias de produtos predefinidas."""
@@ -19,6 +22,54 @@ class ProductCategory(str, Enum):
     OTHER = "Outros"
 
 
+# Padrões usados pelos validadores, compilados uma única vez
+_NON_DIGIT_RE = re.compile(r'[^\d]')
+_NCM_RE = re.compile(r'^\d{4}\.?\d{2}\.?\d{2}$')
+_CEST_RE = re.compile(r'^\d{2}\.?\d{3}\.?\d{2}$')
+
+
+# Mapeia variações comuns para as categorias padrão (montado uma única vez)
+CATEGORY_ALIASES = {
+    'Alimento': 'Alimentos',
+    'Comida': 'Alimentos',
+    'Bebida': 'Bebidas',
+    'Limpeza': 'Limpeza',
+    'Higiene': 'Higiene',
+    'Eletronico': 'Eletrônicos',
+    'Eletrônica': 'Eletrônicos',
+    'Roupa': 'Vestuário',
+    'Vestuario': 'Vestuário',
+    'Automotivo': 'Automotivo',
+    'Carro': 'Automotivo',
+    'Construcao': 'Construção',
+    'Construção': 'Construção',
+    'Outro': 'Outros'
+}
+
+
+# Mesmos aliases indexados sem acentos ("Eletrônico" casa com "Eletronico")
+_FOLDED_CATEGORY_ALIASES = {
+    fold_accents(alias): category for alias, category in CATEGORY_ALIASES.items()
+}
+
+
+# Valores já canônicos (o caso comum vindo da IA) dispensam qualquer limpeza
+_CANONICAL_CATEGORIES = frozenset(category.value for category in ProductCategory)
+
+
+@lru_cache(maxsize=256)
+def normalize_category(category: str) -> str:
+    """
+    Converte uma categoria para o formato padrão. O domínio de entradas é
+    pequeno, então o resultado é memorizado após a primeira ocorrência.
+    """
+    if category in _CANONICAL_CATEGORIES:
+        return category
+
+    category = category.strip().title()
+    return _FOLDED_CATEGORY_ALIASES.get(fold_accents(category), category)
+
+
 class ProcessingStatus(str, Enum):
     """Status do processamento de imagem."""
     PENDING = "pending"
@@ -84,7 +135,7 @@ class ProductBase(BaseModel):
             return v
 
         # Remove qualquer caractere não numérico
-        v = re.sub(r'[^\d]', '', v)
+        v = _NON_DIGIT_RE.sub('', v)
 
         # Verifica se tem comprimento válido
         if len(v) not in [8, 12, 13, 14]:
@@ -99,7 +150,7 @@ class ProductBase(BaseModel):
             return v
 
         # Formato básico do NCM: 8 dígitos (podem ter pontos)
-        if not re.match(r'^\d{4}\.?\d{2}\.?\d{2}$', v):
+        if not _NCM_RE.match(v):
             raise ValueError('NCM deve estar no formato 9999.99.99')
 
         return v
@@ -111,7 +162,7 @@ class ProductBase(BaseModel):
             return v
 
         # Formato básico do CEST: 7 dígitos (podem ter pontos)
-        if not re.match(r'^\d{2}\.?\d{3}\.?\d{2}$', v):
+        if not _CEST_RE.match(v):
             raise ValueError('CEST deve estar no formato 99.999.99')
 
         return v
@@ -247,7 +298,7 @@ class IdentifiedProduct(BaseModel):
             return None
 
         # Remove qualquer caractere não numérico
-        v = re.sub(r'[^\d]', '', v)
+        v = _NON_DIGIT_RE.sub('', v)
 
         # Verifica se tem comprimento válido
         if len(v) not in [8, 12, 13, 14]:
@@ -262,7 +313,7 @@ class IdentifiedProduct(BaseModel):
             return None
 
         # Formato básico do NCM: 8 dígitos (podem ter pontos)
-        if not re.match(r'^\d{4}\.?\d{2}\.?\d{2}$', v):
+        if not _NCM_RE.match(v):
             raise ValueError('NCM deve estar no formato 9999.99.99')
 
         return v
@@ -274,7 +325,7 @@ class IdentifiedProduct(BaseModel):
             return None
 
         # Formato básico do CEST: 7 dígitos (podem ter pontos)
-        if not re.match(r'^\d{2}\.?\d{3}\.?\d{2}$', v):
+        if not _CEST_RE.match(v):
             raise ValueError('CEST deve estar no formato 99.999.99')
 
     @validator('category', pre=True)
@@ -283,28 +334,7 @@ class IdentifiedProduct(BaseModel):
         if v is None or v == "":
             return None
 
-        # Converte para o formato padrão (primeira letra maiúscula)
-        v = v.strip().title()
-
-        # Mapeia variações comuns para as categorias padrão
-        category_mapping = {
-            'Alimento': 'Alimentos',
-            'Comida': 'Alimentos',
-            'Bebida': 'Bebidas',
-            'Limpeza': 'Limpeza',
-            'Higiene': 'Higiene',
-            'Eletronico': 'Eletrônicos',
-            'Eletrônica': 'Eletrônicos',
-            'Roupa': 'Vestuário',
-            'Vestuario': 'Vestuário',
-            'Automotivo': 'Automotivo',
-            'Carro': 'Automotivo',
-            'Construcao': 'Construção',
-            'Construção': 'Construção',
-            'Outro': 'Outros'
-        }
-
-        return category_mapping.get(v, v)
+        return normalize_category(v)
 
 
 class IdentificationRequest(BaseModel):
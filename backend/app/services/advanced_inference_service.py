@@ -1,16 +1,21 @@
 # backend/app/services/advanced_inference_service.py
 
+import copy
+import hashlib
 import logging
 import json
 import re
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import time
+from typing import Dict, Any, List, Optional, Tuple, TypedDict
 
+import orjson
 import google.generativeai as genai
 from google.generativeai.types import GenerationConfig
 
-from app.core.config import GEMINI_API_KEY
+from app.core.cache import TTLCache
+from app.core.config import GEMINI_API_KEY, GEMINI_RPM, GEMINI_TPM
 from app.core.logging_config import log_structured_event
+from app.core.rate_limit import TokenBucket
 from app.utils import validate_gtin
 
 # Configuração de logging
@@ -27,6 +32,46 @@ genai.configure(api_key=GEMINI_API_KEY)
 # Cache de modelo para melhor performance
 _MODEL_CACHE = None
 
+# Mantém o ritmo abaixo da cota (RPM/TPM) para evitar erros 429 e os longos
+# backoffs do SDK. Os tokens do prompt são estimados em ~4 caracteres por token.
+_RPM_LIMITER = TokenBucket(GEMINI_RPM, per=60)
+_TPM_LIMITER = TokenBucket(GEMINI_TPM, per=60)
+
+
+class ProductSchema(TypedDict):
+    """Esquema da resposta da IA para um produto (saída estruturada)."""
+    title: Optional[str]
+    brand: Optional[str]
+    department: Optional[str]
+    category: Optional[str]
+    subcategory: Optional[str]
+    gtin: Optional[str]
+    ncm: Optional[str]
+
+
+class BatchProductSchema(ProductSchema):
+    """Item da resposta em lote: o número do produto liga o item à entrada."""
+    product_index: int
+
+
+class GtinSchema(TypedDict):
+    """Esquema da resposta da IA na extração de GTIN por contexto (RAG)."""
+    gtin: Optional[str]
+
+
+# Configurações de geração montadas uma única vez. O modo JSON com
+# `response_schema` faz o modelo devolver JSON puro e já no formato esperado,
+# sem texto extra ou ```json, dispensando a extração por regex.
+GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1, response_mime_type="application/json",
+    response_schema=ProductSchema)
+BATCH_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1, response_mime_type="application/json",
+    response_schema=List[BatchProductSchema])
+GTIN_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1, response_mime_type="application/json",
+    response_schema=GtinSchema)
+
 
 def get_model() -> Optional[genai.GenerativeModel]:
     """
@@ -46,8 +91,25 @@ def get_model() -> Optional[genai.GenerativeModel]:
     return _MODEL_CACHE
 
 
+def _generate_content(model: genai.GenerativeModel, prompt: str,
+                      generation_config: GenerationConfig):
+    """
+    Chama o modelo respeitando a cota configurada. A concorrência é limitada
+    pelo executor de análises (ver product_service.ANALYSIS_EXECUTOR).
+    """
+    _RPM_LIMITER.acquire()
+    _TPM_LIMITER.acquire(len(prompt) // 4)
+    return model.generate_content(
+        prompt,
+        generation_config=generation_config,
+        safety_settings=SAFETY_SETTINGS
+    )
+
+
 # --- PROMPT OTIMIZADO V2.1 (COM CHAVES ESCAPADAS) ---
-PROMPT_SUPERMERCADO_V2 = """
+# O cabeçalho (instruções + exemplos) é compartilhado entre a análise individual
+# e a análise em lote; apenas o bloco de dados muda.
+_PROMPT_SUPERMERCADO_HEADER = """
 Você é um especialista em catalogação de produtos para varejo, treinado para extrair e inferir informações de textos de embalagens com a máxima precisão.
 Sua missão é analisar o texto de uma etiqueta de produto (OCR) e retornar um JSON estritamente formatado.
 
@@ -109,12 +171,52 @@ Sua Saída:
     "gtin": null,
     "ncm": "3402.50.00"
 }}
+"""
 
---- DADOS PARA ANÁLISE ---
-Texto OCR: "{ocr_text}"
+# Bloco de dados de um único produto, reutilizado nos prompts individual e em lote
+_PRODUCT_DATA_BLOCK = """Texto OCR: "{ocr_text}"
 Logos Detectados: "{logos}"
 """
 
+PROMPT_SUPERMERCADO_V2 = _PROMPT_SUPERMERCADO_HEADER + """
+--- DADOS PARA ANÁLISE ---
+""" + _PRODUCT_DATA_BLOCK
+
+# Regras adicionais para o modo em lote (vários produtos em uma única chamada)
+_PROMPT_BATCH_RULES = """
+--- MODO LOTE ---
+Você receberá {count} produtos numerados. Analise cada um de forma independente.
+Retorne APENAS um array JSON com exatamente {count} objetos, na mesma ordem dos produtos: [{{...}}, {{...}}].
+Cada objeto deve seguir a ESTRUTURA JSON OBRIGATÓRIA acima e incluir também o campo
+"product_index" com o número do produto correspondente (1 a {count}).
+
+--- DADOS PARA ANÁLISE ---
+"""
+
+# Prompts por vertical, montados uma única vez na importação. Verticais sem
+# entrada aqui não têm prompt otimizado e caem no fallback do orquestrador.
+PROMPTS_BY_VERTICAL = {
+    'supermercado': PROMPT_SUPERMERCADO_V2,
+}
+# Cabeçalho do modo lote já com as chaves escapadas resolvidas
+_BATCH_HEADERS_BY_VERTICAL = {
+    'supermercado': _PROMPT_SUPERMERCADO_HEADER.format(),
+}
+
+# Limite de produtos por chamada em lote, para caber na janela de contexto
+MAX_BATCH_SIZE = 10
+
+# Cache de inferência: evita chamar a IA de novo para o mesmo texto OCR.
+# Cada resultado é guardado sob duas chaves: a exata e a do texto normalizado
+# (caixa, espaços e pontuação), que cobre leituras de OCR quase idênticas.
+_INFERENCE_CACHE = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+_NON_WORD_RE = re.compile(r'\W+')
+
+# Limite de caracteres do OCR enviados à IA, para proteger o orçamento do prompt
+MAX_OCR_PROMPT_CHARS = 4096
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_DIGIT_RE = re.compile(r'\D')
+
 # Configurações de segurança para evitar bloqueios desnecessários da API
 SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -126,43 +228,144 @@ SAFETY_SETTINGS = [
 
 def _parse_ai_response(response_text: str) -> Dict[str, Any]:
     """
-    Parse robusto da resposta da IA, limpando possíveis textos extras e marcadores.
+    Parse da resposta da IA. Com `response_schema` a resposta já é um objeto
+    JSON puro; qualquer outro formato é tratado como resposta inválida.
     """
     try:
-        # Remove marcadores de código e espaços extras
-        cleaned_text = re.sub(r'```json\s*|\s*```', '', response_text).strip()
-        # Encontra o JSON principal na string (começa com '{' e termina com '}')
-        match = re.search(r'\{.*\}', cleaned_text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
+        data = orjson.loads(response_text)
+    except orjson.JSONDecodeError as e:
+        logger.error(
+            f"Falha ao parsear JSON da IA: {e}. Resposta: {response_text[:300]}")
+        return {}
+
+    if not isinstance(data, dict):
         logger.warning(
             f"Nenhum JSON válido encontrado na resposta da IA. Resposta: {response_text[:300]}")
         return {}
-    except (json.JSONDecodeError, AttributeError) as e:
+    return data
+
+
+def _parse_ai_list_response(response_text: str) -> Optional[List[Any]]:
+    """
+    Parse da resposta em lote da IA, que deve conter um array JSON.
+    Retorna None se a resposta não for um array válido.
+    """
+    try:
+        data = orjson.loads(response_text)
+    except orjson.JSONDecodeError as e:
         logger.error(
-            f"Falha ao parsear JSON da IA: {e}. Resposta: {response_text[:300]}")
-        return {}
+            f"Falha ao parsear array JSON da IA: {e}. Resposta: {response_text[:300]}")
+        return None
+
+    if not isinstance(data, list):
+        logger.warning(
+            f"Nenhum array JSON válido encontrado na resposta da IA. Resposta: {response_text[:300]}")
+        return None
+    return data
+
+
+def _compact_ocr_text(text: str) -> str:
+    """
+    Reduz o texto OCR antes de enviá-lo à IA: remove linhas vazias ou com um
+    único caractere, elimina linhas repetidas e colapsa espaços em branco.
+    Menos tokens significam chamadas mais rápidas e baratas.
+    """
+    stripped_lines = (line.strip() for line in text.splitlines())
+    lines = dict.fromkeys(line for line in stripped_lines if len(line) >= 2)
+    return _WHITESPACE_RE.sub(' ', ' '.join(lines))[:MAX_OCR_PROMPT_CHARS]
+
+
+def _prompt_fields(vision_data: Dict) -> Dict[str, str]:
+    """Extrai os campos (OCR + logos) usados no bloco de dados do prompt."""
+    ocr_text = _compact_ocr_text(vision_data.get('raw_text') or '')
+    logos = ", ".join(logo['description']
+                      for logo in vision_data.get('detected_logos') or ())
+    return {"ocr_text": ocr_text, "logos": logos}
+
+
+def _inference_cache_keys(vision_data: Dict, vertical: str) -> Tuple[str, str]:
+    """Gera as chaves (exata e normalizada) do cache de inferência."""
+    fields = _prompt_fields(vision_data)
+    exact = json.dumps([vertical, fields["ocr_text"], fields["logos"]],
+                       ensure_ascii=False)
+    normalized = json.dumps([
+        vertical,
+        _NON_WORD_RE.sub(' ', fields["ocr_text"].casefold()).strip(),
+        _NON_WORD_RE.sub(' ', fields["logos"].casefold()).strip()
+    ], ensure_ascii=False)
+    return (hashlib.sha256(exact.encode()).hexdigest(),
+            hashlib.sha256(normalized.encode()).hexdigest())
+
+
+def _get_cached_inference(cache_keys: Tuple[str, str]) -> Optional[Dict]:
+    """Busca um resultado de inferência no cache (exato e depois normalizado)."""
+    for key in cache_keys:
+        cached = _INFERENCE_CACHE.get(key)
+        if cached is not None:
+            # Cópia profunda: o pipeline altera o resultado durante a finalização
+            return copy.deepcopy(cached)
+    return None
+
+
+def _store_cached_inference(cache_keys: Tuple[str, str], result: Dict) -> None:
+    """Guarda apenas resultados bem-sucedidos da IA no cache."""
+    if not result.get("base_data"):
+        return
+    snapshot = copy.deepcopy(result)
+    for key in cache_keys:
+        _INFERENCE_CACHE.set(key, snapshot)
+
+
+def _build_base_data(extracted_data: Dict[str, Any], vertical: str) -> Dict[str, Any]:
+    """
+    Bloco de segurança e limpeza para garantir a qualidade dos dados retornados pela IA.
+    """
+    title = extracted_data.get("title")
+    brand = extracted_data.get("brand")
+    ncm = extracted_data.get("ncm")
+
+    # GTINs lidos errado pelo OCR (ou inferidos pela IA) são descartados aqui
+    # pelo dígito verificador, evitando consultas inúteis ao Cosmos.
+    gtin = _NON_DIGIT_RE.sub('', str(extracted_data.get("gtin") or ''))
+    if gtin and not validate_gtin(gtin):
+        logger.info(f"GTIN '{gtin}' retornado pela IA é inválido e foi descartado.")
+        gtin = None
+
+    return {
+        'title': str(title).strip().title() if title else "Produto Não Identificado",
+        'brand': str(brand).strip().title() if brand else None,
+        'department': extracted_data.get("department"),
+        'category': extracted_data.get("category"),
+        'subcategory': extracted_data.get("subcategory"),
+        'gtin': gtin or None,
+        'ncm': str(ncm) if ncm else None,
+        'confidence': 0.85,  # Confiança base para inferência bem-sucedida
+        'vertical': vertical
+    }
 
 
 def run_advanced_inference(vision_data: Dict, search_results: List[Dict], vertical: str) -> Dict:
     """
     Orquestra a inferência de dados do produto usando um prompt otimizado e tratamento de erros robusto.
     """
-    start_time = datetime.now()
+    start_time = time.monotonic()
     log_structured_event("advanced_inference", "processing_started", {
                          "vertical": vertical})
 
-    if vertical != 'supermercado':
+    prompt_template = PROMPTS_BY_VERTICAL.get(vertical)
+    if prompt_template is None:
         logger.warning(
             f"Vertical '{vertical}' não possui um prompt otimizado. Usando fallback.")
         return {"base_data": {}, "attributes": {}}
 
-    ocr_text = vision_data.get('raw_text', '')
-    logos = [logo['description']
-             for logo in vision_data.get('detected_logos', [])]
+    cache_keys = _inference_cache_keys(vision_data, vertical)
+    cached_result = _get_cached_inference(cache_keys)
+    if cached_result:
+        log_structured_event("advanced_inference", "cache_hit", {
+            "title": cached_result["base_data"].get("title")})
+        return cached_result
 
-    prompt = PROMPT_SUPERMERCADO_V2.format(
-        ocr_text=ocr_text, logos=", ".join(logos))
+    prompt = prompt_template.format(**_prompt_fields(vision_data))
 
     try:
         model = get_model()
@@ -170,12 +373,7 @@ def run_advanced_inference(vision_data: Dict, search_results: List[Dict], vertic
             raise RuntimeError("Modelo de IA não pôde ser inicializado.")
 
         # Geração de conteúdo com configurações de segurança
-        generation_config = GenerationConfig(temperature=0.1)
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=SAFETY_SETTINGS
-        )
+        response = _generate_content(model, prompt, GENERATION_CONFIG)
 
         extracted_data = _parse_ai_response(response.text)
 
@@ -183,27 +381,11 @@ def run_advanced_inference(vision_data: Dict, search_results: List[Dict], vertic
             raise ValueError(
                 "A IA retornou uma resposta vazia ou mal formatada.")
 
-        # --- Bloco de segurança e limpeza para garantir a qualidade dos dados ---
-        title = extracted_data.get("title")
-        brand = extracted_data.get("brand")
-        gtin = extracted_data.get("gtin")
-        ncm = extracted_data.get("ncm")
-
-        base_data = {
-            'title': str(title).strip().title() if title else "Produto Não Identificado",
-            'brand': str(brand).strip().title() if brand else None,
-            'department': extracted_data.get("department"),
-            'category': extracted_data.get("category"),
-            'subcategory': extracted_data.get("subcategory"),
-            'gtin': str(gtin) if gtin else None,
-            'ncm': str(ncm) if ncm else None,
-            'confidence': 0.85,  # Confiança base para inferência bem-sucedida
-            'vertical': vertical
-        }
+        base_data = _build_base_data(extracted_data, vertical)
 
         # O CEST não faz parte do prompt principal, pode ser adicionado por outra estratégia
         attributes = {'cest': None}
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = time.monotonic() - start_time
 
         log_structured_event("advanced_inference", "processing_completed", {
             "title": base_data['title'],
@@ -211,10 +393,12 @@ def run_advanced_inference(vision_data: Dict, search_results: List[Dict], vertic
             "processing_time": round(processing_time, 2)
         })
 
-        return {"base_data": base_data, "attributes": attributes}
+        result = {"base_data": base_data, "attributes": attributes}
+        _store_cached_inference(cache_keys, result)
+        return result
 
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = time.monotonic() - start_time
         log_structured_event("advanced_inference", "processing_failed", {
             "error": str(e), "processing_time": round(processing_time, 2)
         }, "ERROR")
@@ -223,6 +407,116 @@ def run_advanced_inference(vision_data: Dict, search_results: List[Dict], vertic
         return {"base_data": {}, "attributes": {}}
 
 
+def run_advanced_inference_batch(vision_data_list: List[Dict], vertical: str) -> List[Dict]:
+    """
+    Versão em lote de `run_advanced_inference`: envia vários produtos em um único
+    prompt (até MAX_BATCH_SIZE por chamada) e devolve os resultados na mesma ordem.
+    Itens ausentes de uma resposta válida são reprocessados individualmente;
+    se a chamada em lote falhar, os itens daquele lote voltam vazios.
+    """
+    if vertical not in PROMPTS_BY_VERTICAL:
+        logger.warning(
+            f"Vertical '{vertical}' não possui um prompt otimizado. Usando fallback.")
+        return [{"base_data": {}, "attributes": {}} for _ in vision_data_list]
+
+    # Resolve pelo cache o que for possível; só os demais vão para a IA
+    results: List[Optional[Dict]] = [None] * len(vision_data_list)
+    pending = []
+    for index, vision_data in enumerate(vision_data_list):
+        cache_keys = _inference_cache_keys(vision_data, vertical)
+        cached_result = _get_cached_inference(cache_keys)
+        if cached_result:
+            results[index] = cached_result
+        else:
+            pending.append((index, vision_data, cache_keys))
+
+    for offset in range(0, len(pending), MAX_BATCH_SIZE):
+        chunk = pending[offset:offset + MAX_BATCH_SIZE]
+        chunk_results = _run_inference_chunk(
+            [vision_data for _, vision_data, _ in chunk], vertical)
+        for (index, _, cache_keys), result in zip(chunk, chunk_results):
+            _store_cached_inference(cache_keys, result)
+            results[index] = result
+
+    return results
+
+
+def _index_batch_items(extracted_list: List[Any], count: int) -> Dict[int, Dict]:
+    """
+    Associa cada item da resposta em lote ao seu produto pelo `product_index`,
+    e não pela posição: se a IA omitir ou reordenar um objeto, os seguintes
+    não herdam os dados do vizinho. Itens sem índice válido ou com índice
+    repetido são descartados (e reprocessados individualmente).
+    """
+    by_index: Dict[int, Dict] = {}
+    duplicated = set()
+    for item in extracted_list:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("product_index")
+        if type(index) is not int or not 1 <= index <= count:
+            continue
+        if index in by_index:
+            duplicated.add(index)
+        by_index[index] = item
+
+    for index in duplicated:
+        del by_index[index]
+    return by_index
+
+
+def _run_inference_chunk(chunk: List[Dict], vertical: str) -> List[Dict]:
+    """Executa uma única chamada à IA para um lote de até MAX_BATCH_SIZE produtos."""
+    start_time = time.monotonic()
+    log_structured_event("advanced_inference", "batch_processing_started", {
+                         "vertical": vertical, "batch_size": len(chunk)})
+
+    blocks = [f"## PRODUTO {i}:\n" + _PRODUCT_DATA_BLOCK.format(**_prompt_fields(vision_data))
+              for i, vision_data in enumerate(chunk, 1)]
+    prompt = _BATCH_HEADERS_BY_VERTICAL[vertical] + \
+        _PROMPT_BATCH_RULES.format(count=len(chunk)) + "\n".join(blocks)
+
+    extracted_list: Optional[List[Any]] = None
+    try:
+        model = get_model()
+        if not model:
+            raise RuntimeError("Modelo de IA não pôde ser inicializado.")
+
+        response = _generate_content(model, prompt, BATCH_GENERATION_CONFIG)
+        extracted_list = _parse_ai_list_response(response.text)
+    except Exception as e:
+        log_structured_event("advanced_inference", "batch_processing_failed", {
+            "error": str(e), "batch_size": len(chunk)
+        }, "ERROR")
+
+    if extracted_list is None:
+        # A chamada em lote falhou (cota, timeout, bloqueio) ou a resposta não
+        # é um array: refazer item a item multiplicaria as chamadas justo
+        # quando a cota acabou. Devolve resultados vazios (o pipeline usa o
+        # fallback), que não entram no cache.
+        return [{"base_data": {}, "attributes": {}} for _ in chunk]
+
+    extracted_by_index = _index_batch_items(extracted_list, len(chunk))
+
+    results = []
+    for index, vision_data in enumerate(chunk, 1):
+        extracted_data = extracted_by_index.get(index)
+        if extracted_data:
+            results.append({"base_data": _build_base_data(extracted_data, vertical),
+                            "attributes": {'cest': None}})
+        else:
+            # A resposta veio sem este item: tenta a chamada individual
+            results.append(run_advanced_inference(vision_data, [], vertical))
+
+    processing_time = time.monotonic() - start_time
+    log_structured_event("advanced_inference", "batch_processing_completed", {
+        "batch_size": len(chunk),
+        "parsed_items": len(extracted_list),
+        "processing_time": round(processing_time, 2)
+    })
+    return results
+
+
 def extract_gtin_from_context(title: str, search_results: List[Dict]) -> Dict:
     """
     Função de RAG (Retrieval-Augmented Generation) para extrair um GTIN de resultados de busca.
@@ -247,8 +541,7 @@ def extract_gtin_from_context(title: str, search_results: List[Dict]) -> Dict:
             raise RuntimeError(
                 "Modelo de IA não pôde ser inicializado para RAG.")
 
-        response = model.generate_content(
-            prompt, safety_settings=SAFETY_SETTINGS)
+        response = _generate_content(model, prompt, GTIN_GENERATION_CONFIG)
 
         data = _parse_ai_response(response.text)
         found_gtin = data.get("gtin")
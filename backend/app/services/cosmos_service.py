@@ -1,33 +1,43 @@
 # backend/app/services/cosmos_service.py
 
+import copy
 import requests
 import logging
-from typing import Optional, Dict
-from thefuzz import process as fuzzy_process
-from app.core.config import COSMOS_API_KEY
+import orjson
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.cache import MISSING, PersistentCache, SingleFlight, TTLCache
+from app.core.config import API_CACHE_PATH, COSMOS_API_KEY
+from app.core.http_client import build_session
 
 logger = logging.getLogger(__name__)
 BASE_URL = "https://api.cosmos.bluesoft.com.br"
 
+# Sessão reutilizada entre chamadas: evita um novo handshake TCP+TLS por GTIN
+_SESSION = build_session(pool_connections=32, pool_maxsize=32, headers={
+    "X-Cosmos-Token": COSMOS_API_KEY or "",
+    "User-Agent": "CadVisionApp/1.0"
+})
 
-def extract_value(data, key, subkey=None):
-    """
-    Extrai valores de forma segura de dicionários, garantindo sempre retornar strings.
-    """
-    value = data.get(key, {})
-
-    if isinstance(value, dict) and subkey:
-        result = value.get(subkey, "")
-        return str(result) if result is not None else ""
-    elif isinstance(value, str):
-        return value
-    else:
-        return str(value) if value is not None else ""
+# Dados mestres de produto mudam pouco: cache de 24h por GTIN.
+# GTINs inexistentes (404) ficam 1h em cache para não consultar a API à toa.
+GTIN_CACHE_TTL = 24 * 60 * 60
+NOT_FOUND_CACHE_TTL = 60 * 60
+_GTIN_CACHE = TTLCache(maxsize=4096, ttl=GTIN_CACHE_TTL)
+# Segunda camada em disco: sobrevive a reinícios do servidor
+_GTIN_DISK_CACHE = PersistentCache(API_CACHE_PATH, "cosmos", ttl=GTIN_CACHE_TTL,
+                                   max_entries=50000)
 
+# Requisições simultâneas para o mesmo GTIN compartilham uma única chamada HTTP
+_INFLIGHT = SingleFlight()
 
-# Em backend/app/services/cosmos_service.py
+# Com o Cosmos fora do ar, o pipeline pula direto para a inferência por IA
+# em vez de esperar o timeout a cada produto.
+REQUEST_TIMEOUT = 15
+_BREAKER = CircuitBreaker("cosmos", fail_max=5, reset_timeout=30)
 
-# Em backend/app/services/cosmos_service.py
 
 def fetch_product_by_gtin(gtin: str) -> Optional[Dict]:
     """
@@ -37,14 +47,52 @@ def fetch_product_by_gtin(gtin: str) -> Optional[Dict]:
         logger.error("Chave da API Cosmos não configurada.")
         return None
 
+    cached = _GTIN_CACHE.get(gtin, MISSING)
+    if cached is not MISSING:
+        logger.info("GTIN %s encontrado no cache do Cosmos.", gtin)
+        return copy.deepcopy(cached)
+
+    # Cópia profunda: o mesmo objeto é entregue a todas as chamadas agrupadas
+    return copy.deepcopy(_INFLIGHT.do(gtin, _request_product_by_gtin, gtin))
+
+
+def _cache_result(gtin: str, result: Optional[Dict], persist: bool = True) -> None:
+    """Guarda o resultado nas duas camadas; None (404) usa o TTL curto."""
+    ttl = GTIN_CACHE_TTL if result is not None else NOT_FOUND_CACHE_TTL
+    _GTIN_CACHE.set(gtin, result, ttl=ttl)
+    if persist:
+        _GTIN_DISK_CACHE.set(gtin, result, ttl=ttl)
+
+
+def _request_product_by_gtin(gtin: str) -> Optional[Dict]:
+    """
+    Consulta o cache em disco e, se preciso, a API do Cosmos, alimentando os
+    caches. O resultado é compartilhado, portanto não deve ser alterado por quem chama.
+    """
+    cached = _GTIN_DISK_CACHE.get(gtin, MISSING)
+    if cached is not MISSING:
+        logger.info("GTIN %s encontrado no cache persistente do Cosmos.", gtin)
+        _cache_result(gtin, cached, persist=False)
+        return cached
+
+    if not _BREAKER.allow():
+        logger.warning("Circuito do Cosmos aberto; consulta do GTIN %s pulada.", gtin)
+        return None
+
     url = f"{BASE_URL}/gtins/{gtin}.json"
-    headers = {"X-Cosmos-Token": COSMOS_API_KEY,
-               "User-Agent": "CadVisionApp/1.0"}
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        started_at = time.monotonic()
+        response = _SESSION.get(url, timeout=_BREAKER.timeout(REQUEST_TIMEOUT))
+        # Só erros do servidor e limitação de taxa indicam serviço degradado
+        if response.status_code >= 500 or response.status_code == 429:
+            _BREAKER.record_failure()
+        else:
+            _BREAKER.record_success(time.monotonic() - started_at)
+
         if response.status_code == 200:
-            product_data = response.json()
+            # orjson lê os bytes direto, sem decodificar para str antes
+            product_data = orjson.loads(response.content)
             # --- LÓGICA DE FALLBACK DO TÍTULO ADICIONADA ---
             title = product_data.get("description", "").strip()
             brand_name = product_data.get("brand", {}).get("name", "").strip()
@@ -69,13 +117,48 @@ def fetch_product_by_gtin(gtin: str) -> Optional[Dict]:
                 "vertical": "supermercado"
             }
 
-            logger.info(f"📦 Dados formatados do Cosmos: {base_data}")
-            return {"base_data": base_data, "attributes": {}}
+            # O repr do dicionário completo só é montado com DEBUG ativo
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📦 Dados formatados do Cosmos: %s", base_data)
+            result = {"base_data": base_data, "attributes": {}}
+            _cache_result(gtin, result)
+            return result
+
+        if response.status_code == 404:
+            # Cache negativo: o GTIN não existe na base do Cosmos
+            _cache_result(gtin, None)
 
         # ... (resto do tratamento de erros)
         return None
     except requests.exceptions.RequestException as e:
-        logger.error(f"Erro na requisição ao Cosmos: {e}")
+        # O tempo até a falha corrige o timeout adaptativo se ele ficou curto
+        _BREAKER.record_failure(time.monotonic() - started_at)
+        logger.error("Erro na requisição ao Cosmos: %s", e)
+        return None
+    except orjson.JSONDecodeError as e:
+        logger.error("Resposta inválida do Cosmos para o GTIN %s: %s", gtin, e)
         return None
 
-    # Em backend/app/services/cosmos_service.py
+
+def fetch_products_by_gtins(gtins: List[str], max_workers: int = 8) -> Dict[str, Optional[Dict]]:
+    """
+    Busca vários GTINs no Cosmos em paralelo, reutilizando o pool de conexões.
+    Retorna um dicionário {gtin: resultado} (None para os não encontrados).
+    """
+    unique_gtins = list(dict.fromkeys(gtin for gtin in gtins if gtin))
+    if not unique_gtins:
+        return {}
+
+    workers = min(max_workers, len(unique_gtins))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_fetch_product_or_none, unique_gtins)
+        return dict(zip(unique_gtins, results))
+
+
+def _fetch_product_or_none(gtin: str) -> Optional[Dict]:
+    """`fetch_product_by_gtin` que nunca levanta: um GTIN com erro não derruba o lote."""
+    try:
+        return fetch_product_by_gtin(gtin)
+    except Exception as e:
+        logger.error("Erro inesperado ao consultar o GTIN %s no Cosmos: %s", gtin, e)
+        return None
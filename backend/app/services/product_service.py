@@ -1,19 +1,63 @@
 # backend/app/services/product_service.py
 import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Dict, Optional, Any, List, Tuple
 from datetime import datetime
 import sqlite3
 
-from app.services.cosmos_service import fetch_product_by_gtin
+from app.services.cosmos_service import fetch_product_by_gtin, fetch_products_by_gtins
 from app.services.search_service import search_web_for_product
-from app.services.advanced_inference_service import run_advanced_inference, extract_gtin_from_context
+from app.services.advanced_inference_service import (
+    run_advanced_inference, run_advanced_inference_batch, extract_gtin_from_context)
 from app.services.vector_search_service import get_image_embedding, find_match_in_vector_search
 from app.utils import validate_gtin
+from app.core.config import GEMINI_MAX_CONCURRENCY
 from app.database import get_product_by_id
 from app.core.logging_config import log_structured_event
 
 logger = logging.getLogger(__name__)
 
+# Palavras com 3+ caracteres, usadas no título de fallback
+_FALLBACK_WORD_RE = re.compile(r'\S{3,}')
+
+# Sequências isoladas de dígitos com tamanho de GTIN, lidas direto do OCR
+_GTIN_CANDIDATE_RE = re.compile(r'(?<!\d)(\d{14}|\d{13}|\d{12}|\d{8})(?!\d)')
+
+# Executor dedicado às análises, que chamam o Gemini e aguardam (com sleep) o
+# ritmo da cota. Fora do threadpool compartilhado do Starlette, essas esperas
+# não tiram threads das demais rotas, e o tamanho do pool limita as chamadas
+# simultâneas ao Gemini.
+ANALYSIS_EXECUTOR = ThreadPoolExecutor(
+    max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="analysis")
+
+# Consultas antecipadas ao Cosmos, disparadas em paralelo com a inferência da IA
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="cosmos-prefetch")
+
+
+# Preferência entre candidatos: EAN-13 é o padrão nas embalagens brasileiras
+_GTIN_LENGTH_PRIORITY = {13: 0, 14: 1, 12: 2, 8: 3}
+
+
+def _find_gtin_in_ocr(ocr_text: str) -> Optional[str]:
+    """
+    Retorna o GTIN válido (dígito verificador) mais provável do texto OCR,
+    em uma única varredura, priorizando o comprimento mais comum.
+    """
+    best = None
+    for match in _GTIN_CANDIDATE_RE.finditer(ocr_text):
+        candidate = match.group(1)
+        if not validate_gtin(candidate):
+            continue
+        if len(candidate) == 13:
+            return candidate
+        if best is None or _GTIN_LENGTH_PRIORITY[len(candidate)] < _GTIN_LENGTH_PRIORITY[len(best)]:
+            best = candidate
+    return best
+
 
 class ProductAnalysisPipeline:
     """
@@ -23,7 +67,14 @@ class ProductAnalysisPipeline:
 
     def __init__(self, db_connection: sqlite3.Connection):
         self.db = db_connection
-        self.analysis_start_time = datetime.now()
+        # Relógio monotônico: barato e imune a ajustes do relógio do sistema
+        self.analysis_start_time = time.monotonic()
+
+    @staticmethod
+    def _has_text_signals(vision_data: Dict) -> bool:
+        """Indica se há texto OCR ou logos para as estratégias analisarem."""
+        raw_text = vision_data.get('raw_text') or ''
+        return bool(raw_text.strip() or vision_data.get('detected_logos'))
 
     def _is_result_sufficient(self, result: Optional[Dict]) -> bool:
         """Verifica se o resultado obtido é bom o suficiente para parar."""
@@ -44,34 +95,118 @@ class ProductAnalysisPipeline:
         log_structured_event("product_analysis", "pipeline_started", {
                              "vertical": vertical})
 
+        # Sem texto e sem logos, nenhuma estratégia tem com o que trabalhar:
+        # vai direto ao fallback, sem gastar chamadas à IA ou ao Cosmos.
+        if not self._has_text_signals(vision_data):
+            log_structured_event("product_analysis", "short_circuit", {
+                                 "reason": "no_text_signals"}, "WARNING")
+            return self._finalize_result(
+                self._create_emergency_fallback(vision_data, vertical),
+                vision_data, "fallback")
+
+        # Se o código de barras já aparece no OCR, o Cosmos é consultado em
+        # paralelo com a IA. A consulta alimenta o cache (e o agrupamento de
+        # chamadas simultâneas) do cosmos_service, então a Estratégia 2 a
+        # reaproveita quando a IA confirmar esse GTIN ou não trouxer nenhum.
+        ocr_gtin = _find_gtin_in_ocr(vision_data.get('raw_text') or '')
+        if ocr_gtin:
+            _PREFETCH_EXECUTOR.submit(fetch_product_by_gtin, ocr_gtin)
+
         # Estratégia 1 (Principal): Sempre executa a Inferência da IA.
         # Ela nos dará uma base de dados completa, buscando na web se necessário.
         log_structured_event("product_analysis", "attempting_strategy", {
                              "strategy": "AI_INFERENCE"})
         ai_result = self._execute_ai_strategy(vision_data, [], vertical)
+        return self._complete_analysis(vision_data, ai_result, vertical, ocr_gtin)
+
+    def analyze_products_batch(self, vision_data_list: List[Dict], vertical: str) -> List[Dict[str, Any]]:
+        """
+        Versão em lote de `analyze_product` (sem busca visual): a inferência é
+        feita em lote pela IA e os GTINs encontrados são consultados no Cosmos
+        em paralelo, em vez de uma chamada sequencial por produto.
+        Os resultados voltam na mesma ordem da entrada.
+        """
+        log_structured_event("product_analysis", "batch_pipeline_started", {
+                             "vertical": vertical, "batch_size": len(vision_data_list)})
+
+        resolved: List[Optional[Tuple[Dict, str]]] = [None] * len(vision_data_list)
+        pending = []
+        for index, vision_data in enumerate(vision_data_list):
+            if self._has_text_signals(vision_data):
+                pending.append(index)
+            else:
+                resolved[index] = (
+                    self._create_emergency_fallback(vision_data, vertical), "fallback")
+
+        ai_results = run_advanced_inference_batch(
+            [vision_data_list[index] for index in pending], vertical)
+
+        ocr_gtins = [_find_gtin_in_ocr(vision_data_list[index].get('raw_text') or '')
+                     for index in pending]
+        gtins = [self._pick_gtin(ai_result, ocr_gtin)
+                 for ai_result, ocr_gtin in zip(ai_results, ocr_gtins)]
+        cosmos_results = fetch_products_by_gtins([gtin for gtin in gtins if gtin])
+
+        for index, ai_result, ocr_gtin in zip(pending, ai_results, ocr_gtins):
+            resolved[index] = self._resolve_result(
+                vision_data_list[index], ai_result, vertical, ocr_gtin, cosmos_results)
+
+        # As chamadas são compartilhadas pelo lote: cada item recebe a sua
+        # fração do tempo total, e não o tempo do lote inteiro
+        processing_time = ((time.monotonic() - self.analysis_start_time)
+                           / max(len(vision_data_list), 1))
+        return [self._finalize_result(result, vision_data, source, processing_time)
+                for (result, source), vision_data in zip(resolved, vision_data_list)]
+
+    def _complete_analysis(self, vision_data: Dict, ai_result: Dict, vertical: str,
+                           ocr_gtin: Optional[str] = None) -> Dict[str, Any]:
+        """Refina o resultado da IA com o Cosmos, aplica o fallback e finaliza."""
+        final_result, successful_strategy = self._resolve_result(
+            vision_data, ai_result, vertical, ocr_gtin)
+        return self._finalize_result(final_result, vision_data, successful_strategy)
+
+    @staticmethod
+    def _pick_gtin(ai_result: Dict, ocr_gtin: Optional[str]) -> Optional[str]:
+        """
+        GTIN a consultar no Cosmos: o da IA, se válido; senão, o lido direto
+        do OCR (já validado pelo dígito verificador).
+        """
+        gtin_from_ai = str(ai_result.get("base_data", {}).get("gtin") or "")
+        return gtin_from_ai if validate_gtin(gtin_from_ai) else ocr_gtin
+
+    def _resolve_result(self, vision_data: Dict, ai_result: Dict, vertical: str,
+                        ocr_gtin: Optional[str] = None,
+                        cosmos_results: Optional[Dict[str, Optional[Dict]]] = None) -> Tuple[Dict, str]:
+        """
+        Refina o resultado da IA com o Cosmos e aplica o fallback, devolvendo
+        o resultado e a estratégia vencedora. `ocr_gtin` é o GTIN válido lido
+        do OCR, usado quando a IA não traz um. `cosmos_results` traz consultas
+        já feitas em lote; sem ele, o Cosmos é consultado aqui.
+        """
         ai_base_data = ai_result.get("base_data", {})
 
         final_result = ai_result
         successful_strategy = "AI_INFERENCE"
 
-        # Estratégia 2 (Refinamento com Cosmos): Se a IA encontrou um GTIN, usamos o Cosmos.
+        # Estratégia 2 (Refinamento com Cosmos): Se a IA (ou o OCR) trouxe um GTIN, usamos o Cosmos.
         # Os dados do Cosmos são soberanos e vão sobrescrever os da IA.
-        gtin_from_ai = ai_base_data.get("gtin")
-        if gtin_from_ai and validate_gtin(str(gtin_from_ai)):
+        gtin = self._pick_gtin(ai_result, ocr_gtin)
+        if gtin:
             log_structured_event("product_analysis", "attempting_strategy", {
                                  "strategy": "GTIN_LOOKUP"})
-            cosmos_result = self._execute_gtin_strategy(str(gtin_from_ai))
+            if cosmos_results is not None:
+                cosmos_result = cosmos_results.get(gtin)
+            else:
+                cosmos_result = self._execute_gtin_strategy(gtin)
 
             if self._is_result_sufficient(cosmos_result):
                 cosmos_base_data = cosmos_result.get("base_data", {})
 
                 # --- LÓGICA DE FUSÃO DE DADOS ---
-                # Começa com os dados completos da IA.
-                merged_data = ai_base_data.copy()
-                # Sobrescreve com os dados do Cosmos, que são mais confiáveis.
-                merged_data.update(cosmos_base_data)
-                # Garante que a confiança seja a mais alta.
-                merged_data['confidence'] = 0.99
+                # Parte dos dados completos da IA, sobrescreve com os do Cosmos
+                # (mais confiáveis) e garante a confiança mais alta.
+                merged_data = {**ai_base_data, 'gtin': gtin, **cosmos_base_data,
+                               'confidence': 0.99}
 
                 final_result = {"base_data": merged_data,
                                 "attributes": cosmos_result.get("attributes", {})}
@@ -85,7 +220,8 @@ class ProductAnalysisPipeline:
                 vision_data, vertical)
             successful_strategy = "fallback"
 
-        return self._finalize_result(final_result, vision_data, successful_strategy)
+        return final_result, successful_strategy
+
     # --- Implementação das Estratégias ---
 
     def _execute_gtin_strategy(self, gtin: str) -> Optional[Dict]:
@@ -159,8 +295,12 @@ class ProductAnalysisPipeline:
 
     # --- Funções de Finalização e Fallback ---
 
-    def _finalize_result(self, result: Dict, vision_data: Dict, source: str) -> Dict:
-        """Aplica limpeza final e adiciona metadados."""
+    def _finalize_result(self, result: Dict, vision_data: Dict, source: str,
+                         processing_time: Optional[float] = None) -> Dict:
+        """
+        Aplica limpeza final e adiciona metadados. Sem `processing_time`,
+        usa o tempo decorrido desde o início da análise.
+        """
         base_data = result.get("base_data", {})
 
         # Limpeza e padronização final
@@ -170,8 +310,8 @@ class ProductAnalysisPipeline:
             base_data['title'] = "Produto Não Identificado"
 
         # Adiciona metadados para tracking
-        processing_time = (
-            datetime.now() - self.analysis_start_time).total_seconds()
+        if processing_time is None:
+            processing_time = time.monotonic() - self.analysis_start_time
         result["metadata"] = {
             "source_strategy": source,
             "processing_time_seconds": round(processing_time, 2),
@@ -186,7 +326,9 @@ class ProductAnalysisPipeline:
     def _create_emergency_fallback(self, vision_data: Dict, vertical: str) -> Dict:
         """Cria uma resposta mínima quando todas as estratégias falham."""
         ocr_text = vision_data.get('raw_text', '')
-        words = [word for word in ocr_text.split() if len(word) > 2][:4]
+        # Varredura única que para na 4ª palavra, sem dividir o texto inteiro
+        words = [match.group() for match in islice(
+            _FALLBACK_WORD_RE.finditer(ocr_text), 4)]
         fallback_title = f"Produto {' '.join(words)}" if words else "Produto Não Identificado"
 
         return {
@@ -207,3 +349,12 @@ def intelligent_text_analysis(vision_data: Dict, product_image_bytes: Optional[b
     """
     pipeline = ProductAnalysisPipeline(db)
     return pipeline.analyze_product(vision_data, product_image_bytes, vertical)
+
+
+def intelligent_text_analysis_batch(vision_data_list: List[Dict], db: sqlite3.Connection,
+                                    vertical: str) -> List[Dict]:
+    """
+    Função wrapper para analisar vários produtos de uma vez (ex.: upload em massa).
+    """
+    pipeline = ProductAnalysisPipeline(db)
+    return pipeline.analyze_products_batch(vision_data_list, vertical)
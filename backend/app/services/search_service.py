@@ -1,15 +1,61 @@
 # backend/app/services/search_service.py
+import copy
+import hashlib
+import orjson
 import requests
 import logging
 import os
+import re
+import time
 from typing import List, Dict
 
+from app.core.cache import PersistentCache, SingleFlight, TTLCache
 # Carregue as variáveis de ambiente (ajuste o caminho se necessário)
-from app.core.config import GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_ENGINE_ID
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.http_client import build_session
+from app.core.config import API_CACHE_PATH, GOOGLE_SEARCH_API_KEY, GOOGLE_SEARCH_ENGINE_ID
+from app.utils import fold_accents
 
 logger = logging.getLogger(__name__)
 SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
 
+# Sessão única (keep-alive): evita um handshake TCP+TLS por busca
+_SESSION = build_session(pool_connections=4, pool_maxsize=16,
+                         retries=2, backoff_factor=0.2)
+
+# A busca é opcional no pipeline: com a API instável, pula-se a etapa
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 7
+_BREAKER = CircuitBreaker("google_search", fail_max=5, reset_timeout=30)
+
+# Resultados de busca envelhecem mais rápido que dados mestres: cache de 6h,
+# em memória (consultas quentes) e em disco (sobrevive a reinícios).
+SEARCH_CACHE_TTL = 6 * 60 * 60
+_SEARCH_CACHE = TTLCache(maxsize=1024, ttl=SEARCH_CACHE_TTL)
+_SEARCH_DISK_CACHE = PersistentCache(API_CACHE_PATH, "web_search", ttl=SEARCH_CACHE_TTL,
+                                     max_entries=20000)
+
+# Proteção contra "estouro" do cache: queries idênticas em voo viram uma só
+_INFLIGHT = SingleFlight()
+
+
+# Normalização da chave: "Nestlé Ninho 400 g" e "nestle  ninho 400g" são a
+# mesma busca e devem compartilhar a entrada do cache.
+_WHITESPACE_RE = re.compile(r'\s+')
+_NUMBER_UNIT_RE = re.compile(r'(\d) (?=(?:kg|g|mg|ml|l|un)\b)')
+
+
+def _normalize_query(query: str) -> str:
+    """Remove acentos, caixa e variações de espaçamento da query."""
+    query = _WHITESPACE_RE.sub(' ', fold_accents(query).lower()).strip()
+    return _NUMBER_UNIT_RE.sub(r'\1', query)
+
+
+def _search_cache_key(query: str) -> str:
+    """Chave determinística do cache: SHA-256 da query normalizada."""
+    return hashlib.sha256(_normalize_query(query).encode()).hexdigest()
+
+
 def search_web_for_product(query: str) -> List[Dict]:
     """
     Realiza uma busca na web usando a Google Custom Search API.
@@ -19,6 +65,29 @@ def search_web_for_product(query: str) -> List[Dict]:
         logger.warning("API de busca do Google não configurada. Etapa de busca pulada.")
         return []
 
+    cache_key = _search_cache_key(query)
+    items = _SEARCH_CACHE.get(cache_key)
+    if items is not None:
+        logger.info(f"Busca encontrada no cache para a query: '{query}'")
+    else:
+        # Buscas simultâneas pela mesma query compartilham uma única chamada
+        items = _INFLIGHT.do(cache_key, _request_search, query, cache_key)
+
+    # Cópia profunda: a lista cacheada não pode ser alterada por quem chama
+    return copy.deepcopy(items)
+
+
+def _request_search(query: str, cache_key: str) -> List[Dict]:
+    """
+    Consulta o cache em disco e, se preciso, a API de busca, alimentando os
+    caches. O resultado é compartilhado, portanto não deve ser alterado.
+    """
+    items = _SEARCH_DISK_CACHE.get(cache_key)
+    if items is not None:
+        logger.info(f"Busca encontrada no cache persistente para a query: '{query}'")
+        _SEARCH_CACHE.set(cache_key, items)
+        return items
+
     params = {
         'key': GOOGLE_SEARCH_API_KEY,
         'cx': GOOGLE_SEARCH_ENGINE_ID,
@@ -26,19 +95,38 @@ def search_web_for_product(query: str) -> List[Dict]:
         'num': 3  # Os 3 primeiros resultados são suficientes
     }
 
+    if not _BREAKER.allow():
+        logger.warning("Circuito da API de busca aberto. Etapa de busca pulada.")
+        return []
+
     try:
         logger.info(f"Buscando na web com a query: '{query}'")
-        response = requests.get(SEARCH_URL, params=params, timeout=10)
+        started_at = time.monotonic()
+        response = _SESSION.get(SEARCH_URL, params=params,
+                                timeout=(CONNECT_TIMEOUT, _BREAKER.timeout(READ_TIMEOUT)))
+        if response.status_code >= 500 or response.status_code == 429:
+            _BREAKER.record_failure()
+        else:
+            _BREAKER.record_success(time.monotonic() - started_at)
         response.raise_for_status()
-        results = response.json()
-
-        if "items" not in results:
-            return []
+        # orjson lê os bytes direto, sem decodificar para str antes
+        results = orjson.loads(response.content)
 
         # Retorna apenas o título e o snippet, que é o que precisamos
-        return [{"title": item.get("title"), "snippet": item.get("snippet")}
-                for item in results.get("items", [])]
+        items = [{"title": item.get("title"), "snippet": item.get("snippet")}
+                 for item in results.get("items", [])]
+
+        # Só respostas bem-sucedidas (mesmo sem resultados) entram no cache
+        _SEARCH_CACHE.set(cache_key, items)
+        _SEARCH_DISK_CACHE.set(cache_key, items)
+        return items
 
     except requests.exceptions.RequestException as e:
+        if e.response is None:
+            # Falha de rede/timeout; status HTTP já foi contabilizado acima
+            _BREAKER.record_failure(time.monotonic() - started_at)
         logger.error(f"Erro na chamada da API de busca: {e}")
-        return []
\ No newline at end of file
+        return []
+    except orjson.JSONDecodeError as e:
+        logger.error(f"Resposta inválida da API de busca: {e}")
+        return []
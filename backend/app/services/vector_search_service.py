@@ -1,18 +1,59 @@
 import logging
 import requests
 import base64
+import threading
+import time
 from typing import Optional, Dict, List
+
+import numpy as np
 from google.cloud import aiplatform
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
+from app.core.cache import PersistentCache, SingleFlight, TTLCache
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.http_client import build_session
 from app.core.config import (
-    GOOGLE_PROJECT_ID, GOOGLE_INDEX_ID, GOOGLE_INDEX_ENDPOINT_ID,
+    API_CACHE_PATH, GOOGLE_PROJECT_ID, GOOGLE_INDEX_ID, GOOGLE_INDEX_ENDPOINT_ID,
     GOOGLE_KEY_PATH, GOOGLE_CLOUD_REGION, GOOGLE_INDEX_PUBLIC_DOMAIN,
-    GOOGLE_DEPLOYED_INDEX_ID  # <-- IMPORTADO
+    GOOGLE_DEPLOYED_INDEX_ID, GOOGLE_INDEX_DISTANCE_MEASURE, VECTOR_MATCH_THRESHOLD
 )
+from app.utils import content_hash
 
 logger = logging.getLogger(__name__)
 
+# O embedding de uma imagem é determinístico: a mesma foto (reenvios,
+# retentativas) não precisa voltar à Vertex AI. Cache em memória (LRU) e em
+# disco, chaveado pelo hash do conteúdo da imagem. Os dois guardam o vetor em
+# float32 (~5,6 KB), a mesma precisão com que o índice o armazena, então um
+# vetor cacheado pode ser gravado no índice sem perda.
+_EMBEDDING_CACHE = TTLCache(maxsize=4096)
+# No disco: 30 dias e no máximo 10 mil vetores (~75 MB em base64), para o arquivo não crescer sem limite
+EMBEDDING_DISK_CACHE_TTL = 30 * 24 * 60 * 60
+_EMBEDDING_DISK_CACHE = PersistentCache(API_CACHE_PATH, "image_embedding_f32",
+                                        ttl=EMBEDDING_DISK_CACHE_TTL, max_entries=10000)
+_INFLIGHT = SingleFlight()
+
+# Sessão única (keep-alive) para as chamadas REST da Vertex AI
+_SESSION = build_session(pool_connections=16, pool_maxsize=64,
+                         retries=3, backoff_factor=0.2)
+
+# Com a Vertex AI instável, a busca visual é pulada em vez de travar o pipeline.
+# Um disjuntor por endpoint: o :predict recebe imagens de até 10 MB e leva
+# muito mais que o :findNeighbors, então não podem dividir o timeout adaptativo.
+CONNECT_TIMEOUT = 3.05
+EMBEDDING_TIMEOUT = 30
+VECTOR_SEARCH_TIMEOUT = 10
+_EMBEDDING_BREAKER = CircuitBreaker("vertex_ai_embedding", fail_max=5, reset_timeout=30)
+_VECTOR_SEARCH_BREAKER = CircuitBreaker("vertex_ai_vector_search", fail_max=5, reset_timeout=30)
+
+# Nas métricas de similaridade (produto escalar, cosseno) "distance" maior é
+# melhor; nas de distância (L1, L2 ao quadrado), menor é melhor.
+_LOWER_IS_BETTER_MEASURES = frozenset(("SQUARED_L2_DISTANCE", "L1_DISTANCE"))
+_LOWER_IS_BETTER = GOOGLE_INDEX_DISTANCE_MEASURE in _LOWER_IS_BETTER_MEASURES
+
+# Poucos candidatos aproximados bastam para achar o vizinho mais próximo
+APPROXIMATE_NEIGHBOR_COUNT = 10
+
 credentials = None
 vertex_ai_client_initialized = False
 try:
@@ -20,7 +61,7 @@ try:
         scopes = ["https://www.googleapis.com/auth/cloud-platform"]
         credentials = service_account.Credentials.from_service_account_file(
             GOOGLE_KEY_PATH, scopes=scopes)
-        credentials.refresh(Request())
+        credentials.refresh(Request(_SESSION))
         logger.info("Credenciais do Google Cloud carregadas com sucesso.")
         vertex_ai_client_initialized = True
     else:
@@ -38,25 +79,105 @@ if vertex_ai_client_initialized:
         logger.error(f"Erro ao inicializar o cliente da Vertex AI: {e}")
 
 
+_token_lock = threading.Lock()
+
+
+def _get_access_token() -> str:
+    """
+    Token de acesso atual, renovado só quando expirado ou perto de expirar
+    (o token dura ~1h; antes, ele nunca era renovado após a inicialização).
+    """
+    with _token_lock:
+        if not credentials.valid:
+            credentials.refresh(Request(_SESSION))
+            logger.info("Token de acesso do Google Cloud renovado.")
+        return credentials.token
+
+
+def _post_to_vertex(endpoint_url: str, request_body: Dict, breaker: CircuitBreaker,
+                    read_timeout: float) -> Optional[requests.Response]:
+    """
+    POST autenticado na API REST da Vertex AI, protegido pelo disjuntor do
+    endpoint. Retorna None quando o circuito está aberto; erros HTTP são propagados.
+    """
+    if not breaker.allow():
+        logger.warning(f"Circuito '{breaker.name}' aberto; chamada pulada.")
+        return None
+
+    started_at = time.monotonic()
+    try:
+        headers = {"Authorization": f"Bearer {_get_access_token()}",
+                   "Content-Type": "application/json; charset=utf-8"}
+        response = _SESSION.post(
+            endpoint_url, json=request_body, headers=headers,
+            timeout=(CONNECT_TIMEOUT, breaker.timeout(read_timeout)))
+    except Exception:
+        # Falha de rede ou na renovação do token: conta para o disjuntor
+        breaker.record_failure(time.monotonic() - started_at)
+        raise
+
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success(time.monotonic() - started_at)
+    response.raise_for_status()
+    return response
+
+
+def _embedding_cache_key(image_bytes: bytes) -> str:
+    """Chave do cache de embeddings: hash do conteúdo da imagem."""
+    return content_hash(image_bytes)
+
+
 def get_image_embedding(image_bytes: bytes) -> Optional[List[float]]:
     if not vertex_ai_client_initialized:
         return None
+
+    cache_key = _embedding_cache_key(image_bytes)
+    packed = _EMBEDDING_CACHE.get(cache_key)
+    if packed is not None:
+        logger.info("Embedding da imagem encontrado no cache.")
+        return np.frombuffer(packed, dtype=np.float32).tolist()
+
+    # Envios simultâneos da mesma imagem compartilham uma única chamada
+    image_embedding = _INFLIGHT.do(
+        cache_key, _request_image_embedding, image_bytes, cache_key)
+    # Cópia: a mesma lista é entregue a todas as chamadas agrupadas
+    return list(image_embedding) if image_embedding is not None else None
+
+
+def _request_image_embedding(image_bytes: bytes, cache_key: str) -> Optional[List[float]]:
+    """
+    Consulta o cache em disco e, se preciso, a Vertex AI, alimentando os
+    caches. O resultado é compartilhado, portanto não deve ser alterado.
+    """
+    encoded_payload = _EMBEDDING_DISK_CACHE.get(cache_key)
+    if encoded_payload is not None:
+        logger.info("Embedding da imagem encontrado no cache persistente.")
+        packed = base64.b64decode(encoded_payload)
+        _EMBEDDING_CACHE.set(cache_key, packed)
+        return np.frombuffer(packed, dtype=np.float32).tolist()
+
     try:
         encoded_content = base64.b64encode(image_bytes).decode("utf-8")
         endpoint_url = f"https://{GOOGLE_CLOUD_REGION}-aiplatform.googleapis.com/v1/projects/{GOOGLE_PROJECT_ID}/locations/{GOOGLE_CLOUD_REGION}/publishers/google/models/multimodalembedding@001:predict"
-        auth_token = credentials.token
-        headers = {"Authorization": f"Bearer {auth_token}",
-                   "Content-Type": "application/json; charset=utf-8"}
         request_body = {"instances": [
             {"image": {"bytesBase64Encoded": encoded_content}}]}
         logger.info("Gerando embedding via API REST...")
-        response = requests.post(
-            endpoint_url, json=request_body, headers=headers)
-        response.raise_for_status()
+        response = _post_to_vertex(
+            endpoint_url, request_body, _EMBEDDING_BREAKER, EMBEDDING_TIMEOUT)
+        if response is None:
+            return None
         response_json = response.json()
         image_embedding = response_json['predictions'][0]['imageEmbedding']
         logger.info(
             "Vetor (embedding) da imagem gerado com sucesso via API REST.")
+        packed = np.asarray(image_embedding, dtype=np.float32).tobytes()
+        _EMBEDDING_CACHE.set(cache_key, packed)
+        # O cache em disco guarda JSON: os bytes do float32 vão em base64,
+        # bem menores que a lista de floats serializada
+        _EMBEDDING_DISK_CACHE.set(cache_key, base64.b64encode(packed).decode("ascii"))
+        # A chamada que gerou o vetor recebe o valor original da API
         return image_embedding
     except Exception as e:
         logger.error(
@@ -64,11 +185,28 @@ def get_image_embedding(image_bytes: bytes) -> Optional[List[float]]:
         return None
 
 
+_index = None
+_index_lock = threading.Lock()
+
+
+def _get_index() -> "aiplatform.MatchingEngineIndex":
+    """
+    Retorna o handle do índice, criado uma única vez: o construtor faz uma
+    chamada de metadados à Vertex AI que não precisa se repetir a cada upsert.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = aiplatform.MatchingEngineIndex(index_name=GOOGLE_INDEX_ID)
+    return _index
+
+
 def add_image_to_index(sku_id: str, image_embedding: List[float]):
     if not vertex_ai_client_initialized or not GOOGLE_INDEX_ID:
         return False
     try:
-        my_index = aiplatform.MatchingEngineIndex(index_name=GOOGLE_INDEX_ID)
+        my_index = _get_index()
         datapoint = aiplatform.IndexDatapoint(
             datapoint_id=sku_id, feature_vector=image_embedding)
         my_index.upsert_datapoints(datapoints=[datapoint])
@@ -82,62 +220,96 @@ def add_image_to_index(sku_id: str, image_embedding: List[float]):
 
 def find_match_in_vector_search(image_embedding: List[float]) -> Optional[Dict]:
     """Consulta o índice via API REST para encontrar a imagem mais similar."""
+    return find_matches_in_vector_search([image_embedding])[0]
+
+
+def find_matches_in_vector_search(image_embeddings: List[List[float]]) -> List[Optional[Dict]]:
+    """
+    Consulta o índice com vários vetores em uma única chamada findNeighbors.
+    Retorna, na mesma ordem da entrada, a melhor correspondência de cada
+    vetor (ou None quando não houver correspondência confiável).
+    """
+    if not image_embeddings:
+        return []
+
+    no_matches = [None] * len(image_embeddings)
+
     # Verificação atualizada
     if not all([vertex_ai_client_initialized, GOOGLE_INDEX_ENDPOINT_ID, GOOGLE_INDEX_PUBLIC_DOMAIN, GOOGLE_DEPLOYED_INDEX_ID]):
         logger.error(
             "Não é possível consultar: Cliente não inicializado ou IDs/Domínio ausentes.")
-        return None
+        return no_matches
 
     try:
         endpoint_url = f"https://{GOOGLE_INDEX_PUBLIC_DOMAIN}/v1/projects/{GOOGLE_PROJECT_ID}/locations/{GOOGLE_CLOUD_REGION}/indexEndpoints/{GOOGLE_INDEX_ENDPOINT_ID}:findNeighbors"
 
-        # --- ALTERADO ---
-        # O ID da implantação agora vem do arquivo de configuração
-        # deployed_index_id = "idx_vestuario_implantado_v_1758595018034" # REMOVIDO
-
         request_body = {
-            "deployedIndexId": GOOGLE_DEPLOYED_INDEX_ID,  # USADO AQUI
+            "deployedIndexId": GOOGLE_DEPLOYED_INDEX_ID,
             "queries": [
-                {"datapoint": {"featureVector": image_embedding, "neighborCount": 1}}
-            ]
+                {"datapoint": {"featureVector": embedding},
+                 "neighborCount": 1,
+                 "approximateNeighborCount": APPROXIMATE_NEIGHBOR_COUNT}
+                for embedding in image_embeddings
+            ],
+            # Só o ID e a distância são usados: não trafega o vetor de volta
+            "returnFullDatapoint": False
         }
 
-        auth_token = credentials.token
-        headers = {"Authorization": f"Bearer {auth_token}",
-                   "Content-Type": "application/json; charset=utf-8"}
-
         logger.info(
-            f"Consultando a Vector Search no endpoint público: {GOOGLE_INDEX_PUBLIC_DOMAIN}...")
-        response = requests.post(
-            endpoint_url, json=request_body, headers=headers)
-        response.raise_for_status()
+            f"Consultando a Vector Search ({len(image_embeddings)} vetor(es)) no endpoint público: {GOOGLE_INDEX_PUBLIC_DOMAIN}...")
+        response = _post_to_vertex(
+            endpoint_url, request_body, _VECTOR_SEARCH_BREAKER, VECTOR_SEARCH_TIMEOUT)
+        if response is None:
+            return no_matches
 
-        response_json = response.json()
-        neighbors = response_json.get('nearestNeighbors', [{}])[
-            0].get('neighbors', [])
+        # A API devolve um item em nearestNeighbors por query, na mesma ordem
+        nearest_neighbors = response.json().get('nearestNeighbors', [])
+        matches = [_safe_best_match(entry) for entry in nearest_neighbors]
+        return (matches + no_matches)[:len(image_embeddings)]
 
-        if not neighbors:
-            logger.info("Nenhuma correspondência encontrada na Vector Search.")
-            return None
+    except requests.exceptions.RequestException as e:
+        logger.error(
+            f"Erro na chamada REST para consultar a Vector Search: {e.response.text if e.response else e}")
+        return no_matches
+    except Exception as e:
+        logger.error(f"Erro inesperado ao consultar a Vector Search: {e}")
+        return no_matches
 
-        best_match = neighbors[0]
-        sku_id = best_match.get('datapoint', {}).get('datapointId')
-        confidence = best_match.get('distance')
 
-        logger.info(
-            f"Correspondência encontrada! SKU: {sku_id}, Confiança: {confidence:.4f}")
+def _is_confident(distance: float) -> bool:
+    """Aplica o limiar respeitando a direção da métrica do índice."""
+    if _LOWER_IS_BETTER:
+        return distance <= VECTOR_MATCH_THRESHOLD
+    return distance > VECTOR_MATCH_THRESHOLD
 
-        if confidence > 0.8:
-            return {"product_id": sku_id, "confidence": confidence}
 
-        logger.warning(
-            f"Correspondência com baixa confiança ({confidence:.4f}) foi descartada.")
+def _safe_best_match(entry: Dict) -> Optional[Dict]:
+    """Isola cada query do lote: uma entrada malformada não derruba as demais."""
+    try:
+        return _best_match(entry.get('neighbors', []))
+    except (AttributeError, TypeError, ValueError) as e:
+        logger.error(f"Resposta inesperada da Vector Search para uma query: {e}")
         return None
 
-    except requests.exceptions.RequestException as e:
-        logger.error(
-            f"Erro na chamada REST para consultar a Vector Search: {e.response.text if e.response else e}")
-        return None
-    except Exception as e:
-        logger.error(f"Erro inesperado ao consultar a Vector Search: {e}")
+
+def _best_match(neighbors: List[Dict]) -> Optional[Dict]:
+    """Extrai a melhor correspondência, descartando as de baixa confiança."""
+    if not neighbors:
+        logger.info("Nenhuma correspondência encontrada na Vector Search.")
         return None
+
+    best_match = neighbors[0]
+    sku_id = best_match.get('datapoint', {}).get('datapointId')
+    # O JSON do proto3 omite campos double iguais a zero: em métricas L1/L2,
+    # a correspondência exata (distância 0.0) chega sem "distance"
+    confidence = float(best_match.get('distance', 0.0))
+
+    logger.info(
+        f"Correspondência encontrada! SKU: {sku_id}, Confiança: {confidence:.4f}")
+
+    if _is_confident(confidence):
+        return {"product_id": sku_id, "confidence": confidence}
+
+    logger.warning(
+        f"Correspondência com baixa confiança ({confidence:.4f}) foi descartada.")
+    return None
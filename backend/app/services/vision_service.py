@@ -16,6 +16,7 @@ from google.api_core.exceptions import GoogleAPICallError, RetryError
 # Usamos uma versão específica para admin
 from google.cloud import vision_v1p4beta1 as vision
 from app.core.config import GOOGLE_KEY_PATH
+from app.utils import fold_accents
 
 # Defina CACHE_DIR localmente se não estiver disponível no config
 try:
@@ -46,18 +47,65 @@ KNOWN_BRANDS = {
     'samsung', 'lg', 'sony', 'philips', 'electrolux', 'brahma', 'skol', 'antarctica'
 }
 
-# Palavras-chave para categorias
+# Palavras-chave para categorias, na ordem de prioridade da detecção
 CATEGORY_KEYWORDS = {
-    'alimentos': ['arroz', 'feijão', 'macarrão', 'óleo', 'açúcar', 'farinha', 'leite', 'café'],
-    'bebidas': ['refrigerante', 'cerveja', 'suco', 'água', 'vinho', 'whisky', 'vodka'],
-    'limpeza': ['sabão', 'detergente', 'desinfetante', 'álcool', 'água sanitária', 'amaciante'],
-    'higiene': ['shampoo', 'condicionador', 'sabonete', 'pasta de dente', 'papel higiênico'],
-    'eletrônicos': ['celular', 'tv', 'notebook', 'tablet', 'fone de ouvido', 'câmera']
+    'Alimentos': ('arroz', 'feijão', 'macarrão', 'óleo', 'açúcar', 'farinha', 'leite', 'café', 'comida', 'alimento'),
+    'Bebidas': ('refrigerante', 'cerveja', 'suco', 'água', 'vinho', 'whisky', 'vodka', 'bebida', 'drink'),
+    'Limpeza': ('sabão', 'detergente', 'desinfetante', 'álcool', 'água sanitária', 'amaciante', 'limpeza'),
+    'Higiene': ('shampoo', 'condicionador', 'sabonete', 'pasta de dente', 'papel higiênico', 'higiene'),
+    'Eletrônicos': ('celular', 'tv', 'notebook', 'tablet', 'fone de ouvido', 'câmera', 'eletrônico'),
+    'Vestuário': ('camisa', 'calça', 'vestido', 'roupa', 'moda', 'vestuário'),
+    'Automotivo': ('carro', 'motor', 'óleo motor', 'pneu', 'automotivo'),
+    'Construção': ('cimento', 'tijolo', 'ferro', 'construção', 'obra'),
 }
 
+# Todas as marcas conhecidas em uma única alternância (as mais longas primeiro)
+_KNOWN_BRANDS_RE = re.compile(
+    '|'.join(map(re.escape, sorted(KNOWN_BRANDS, key=lambda brand: (-len(brand), brand)))))
+
+
+def _build_keyword_index() -> Dict[str, Tuple[int, str]]:
+    """
+    Monta o índice palavra-chave sem acentos -> (prioridade, categoria).
+    A comparação ignora acentos: OCR e labels nem sempre os preservam.
+    """
+    index: Dict[str, Tuple[int, str]] = {}
+    for rank, (category, keywords) in enumerate(CATEGORY_KEYWORDS.items()):
+        for keyword in keywords:
+            index.setdefault(fold_accents(keyword), (rank, category))
+    return index
+
+
+_KEYWORD_CATEGORY = _build_keyword_index()
+
+# Todas as palavras-chave em uma única alternância, varrida em uma só passada.
+# O lookahead permite ocorrências sobrepostas ("óleo" e "óleo motor"), então
+# nenhuma palavra-chave presente no texto deixa de ser vista.
+_CATEGORY_KEYWORD_RE = re.compile(
+    '(?=(' + '|'.join(map(re.escape, _KEYWORD_CATEGORY)) + '))')
+
+
+def _match_category(text_lower: str) -> Optional[str]:
+    """
+    Retorna a categoria de maior prioridade (ordem de CATEGORY_KEYWORDS) com
+    alguma palavra-chave presente no texto, ou None.
+    """
+    best = None
+    for match in _CATEGORY_KEYWORD_RE.finditer(fold_accents(text_lower)):
+        rank, category = _KEYWORD_CATEGORY[match.group(1)]
+        if best is None or rank < best[0]:
+            best = (rank, category)
+            if rank == 0:
+                break
+    return best[1] if best else None
+
 
 def get_cache_key(image_bytes: bytes) -> str:
-    """Gera uma chave única para cache baseada no conteúdo da imagem."""
+    """
+    Gera uma chave única baseada no conteúdo da imagem. O valor é persistido
+    (products.image_hash, processing_logs), então o algoritmo é fixo em MD5:
+    trocá-lo mudaria o identificador de todos os registros existentes.
+    """
     return hashlib.md5(image_bytes).hexdigest()
 
 
@@ -115,45 +163,116 @@ def enhance_image_for_ocr(image_bytes: bytes) -> bytes:
         return image_bytes
 
 
-# SUBSTITUA a função extract_vision_data por esta:
+# Texto, logos e labels são pedidos juntos: uma única chamada à API por imagem
+_VISION_FEATURES = [
+    vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.LOGO_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION),
+]
+
+
+def _empty_vision_data() -> Dict:
+    return {'raw_text': "", 'detected_logos': [], 'detected_labels': [], 'success': False}
+
+
+def _parse_annotate_response(response) -> Dict:
+    """Converte um AnnotateImageResponse no dicionário usado pelo pipeline."""
+    if response.error.message:
+        logger.error(f"Erro retornado pela Vision API: {response.error.message}")
+        return _empty_vision_data()
+
+    # Processa texto
+    raw_text = response.text_annotations[0].description.strip() if response.text_annotations else ""
+
+    # Processa logos
+    detected_logos = [{'description': logo.description, 'score': logo.score} for logo in response.logo_annotations]
+
+    # Processa labels
+    detected_labels = [{'description': label.description, 'score': label.score} for label in response.label_annotations]
+
+    logger.info(f"Vision API: Texto extraído ({len(raw_text)} chars), Logos: {len(detected_logos)}, Labels: {len(detected_labels)}")
+
+    return {
+        'raw_text': raw_text,
+        'detected_logos': detected_logos,
+        'detected_labels': detected_labels,
+        'success': bool(raw_text or detected_logos or detected_labels)
+    }
+
 
 def extract_vision_data(image_bytes: bytes) -> Dict:
     """
     Extrai texto, logos e labels de uma imagem usando a API do Google Vision.
-    Esta é a versão final e simplificada.
+    As três detecções vão em uma única requisição (annotate_image).
     """
     if not vision_client:
         logger.warning("Serviço do Vision não está disponível.")
-        return {'raw_text': "", 'detected_logos': [], 'detected_labels': [], 'success': False}
+        return _empty_vision_data()
 
     try:
-        image = vision.Image(content=image_bytes)
-        
-        # Faz detecções
-        text_response = vision_client.text_detection(image=image)
-        logo_response = vision_client.logo_detection(image=image)
-        label_response = vision_client.label_detection(image=image)
-
-        # Processa texto
-        raw_text = text_response.text_annotations[0].description.strip() if text_response.text_annotations else ""
-
-        # Processa logos
-        detected_logos = [{'description': logo.description, 'score': logo.score} for logo in logo_response.logo_annotations]
-
-        # Processa labels
-        detected_labels = [{'description': label.description, 'score': label.score} for label in label_response.label_annotations]
-
-        logger.info(f"Vision API: Texto extraído ({len(raw_text)} chars), Logos: {len(detected_logos)}, Labels: {len(detected_labels)}")
-        
-        return {
-            'raw_text': raw_text,
-            'detected_logos': detected_logos,
-            'detected_labels': detected_labels,
-            'success': bool(raw_text or detected_logos or detected_labels)
-        }
+        request = vision.AnnotateImageRequest(
+            image=vision.Image(content=image_bytes), features=_VISION_FEATURES)
+        response = vision_client.annotate_image(request)
+        return _parse_annotate_response(response)
     except Exception as e:
         logger.error(f"Erro durante a extração de dados do Vision: {e}")
-        return {'raw_text': "", 'detected_logos': [], 'detected_labels': [], 'success': False}
+        return _empty_vision_data()
+
+
+# Máximo de imagens aceito pela Vision API em uma chamada batch_annotate_images
+VISION_BATCH_SIZE = 16
+# Conteúdo (bytes das imagens) máximo por chamada, mantendo cada requisição
+# bem abaixo do limite de tamanho da API mesmo com imagens grandes
+VISION_BATCH_MAX_BYTES = 16 * 1024 * 1024
+
+
+def _vision_batches(images: List[bytes]):
+    """Agrupa as imagens em lotes limitados por quantidade e por bytes."""
+    batch: List[bytes] = []
+    batch_bytes = 0
+    for image_bytes in images:
+        if batch and (len(batch) == VISION_BATCH_SIZE
+                      or batch_bytes + len(image_bytes) > VISION_BATCH_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(image_bytes)
+        batch_bytes += len(image_bytes)
+    if batch:
+        yield batch
+
+
+def extract_vision_data_batch(images: List[bytes]) -> List[Dict]:
+    """
+    Versão em lote de `extract_vision_data`: agrupa as imagens em chamadas
+    batch_annotate_images (até VISION_BATCH_SIZE imagens e
+    VISION_BATCH_MAX_BYTES por chamada) em vez de uma chamada por imagem.
+    Se um lote falhar, suas imagens são processadas individualmente.
+    Os resultados voltam na mesma ordem da entrada.
+    """
+    if not vision_client:
+        logger.warning("Serviço do Vision não está disponível.")
+        return [_empty_vision_data() for _ in images]
+
+    results: List[Dict] = []
+    for chunk in _vision_batches(images):
+        annotate_requests = [vision.AnnotateImageRequest(
+            image=vision.Image(content=image_bytes), features=_VISION_FEATURES)
+            for image_bytes in chunk]
+        try:
+            response = vision_client.batch_annotate_images(requests=annotate_requests)
+            results.extend(_parse_annotate_response(item)
+                           for item in response.responses)
+        except Exception as e:
+            logger.error(f"Erro durante a extração de dados do Vision em lote: {e}")
+            # Uma imagem problemática não deve invalidar o lote inteiro
+            results.extend(extract_vision_data(image_bytes) for image_bytes in chunk)
+
+    return results
+
+
+# Padrões de limpeza de texto, compilados uma única vez
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNSAFE_CHARS_RE = re.compile(r'[^\w\s.,;:!?@#$%&*()\-+]')
 
 
 def clean_text(text: str) -> str:
@@ -164,14 +283,22 @@ def clean_text(text: str) -> str:
         return text
 
     # Remove múltiplos espaços e quebras de linha excessivas
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = _WHITESPACE_RE.sub(' ', text).strip()
 
     # Remove caracteres especiais problemáticos, mas mantém pontuação básica
-    text = re.sub(r'[^\w\s.,;:!?@#$%&*()\-+]', '', text)
+    text = _UNSAFE_CHARS_RE.sub('', text)
 
     return text
 
 
+# Padrões comuns de marca, em ordem de preferência
+_BRAND_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'(?i)marca[:\s]+([^\n\r.,;]+)',
+    r'(?i)brand[:\s]+([^\n\r.,;]+)',
+    r'(?i)(fabricante|manufacturer)[:\s]+([^\n\r.,;]+)'
+))
+
+
 def extract_brand_from_data(text: str, logos: List) -> str:
     """
     Extrai a marca do texto e dos logos detectados.
@@ -181,43 +308,39 @@ def extract_brand_from_data(text: str, logos: List) -> str:
         if logo.get('score', 0) > 0.7:
             brand_candidate = logo['description'].lower().strip()
             # Verifica se é uma marca conhecida
-            if any(brand in brand_candidate for brand in KNOWN_BRANDS):
+            if _KNOWN_BRANDS_RE.search(brand_candidate):
                 return logo['description'].title()
 
-    # Procura no texto por marcas conhecidas
-    text_lower = text.lower()
-    for brand in KNOWN_BRANDS:
-        if brand in text_lower:
-            # Encontra a ocorrência exata no texto original
-            brand_pattern = re.compile(re.escape(brand), re.IGNORECASE)
-            match = brand_pattern.search(text)
-            if match:
-                return match.group().title()
+    # Procura no texto por marcas conhecidas, em uma única varredura
+    match = _KNOWN_BRANDS_RE.search(text.lower())
+    if match:
+        # A ocorrência difere da marca só na caixa, que .title() normaliza
+        return match.group().title()
 
     # Procura por padrões comuns de marca
-    brand_patterns = [
-        r'(?i)marca[:\s]+([^\n\r.,;]+)',
-        r'(?i)brand[:\s]+([^\n\r.,;]+)',
-        r'(?i)(fabricante|manufacturer)[:\s]+([^\n\r.,;]+)'
-    ]
-
-    for pattern in brand_patterns:
-        matches = re.findall(pattern, text)
-        if matches:
-            for match in matches:
-                if isinstance(match, tuple):
-                    brand_candidate = match[1].strip()
-                else:
-                    brand_candidate = match.strip()
-
-                if len(brand_candidate) > 2:  # Ignora palavras muito curtas
-                    return brand_candidate.title()
+    for pattern in _BRAND_PATTERNS:
+        # finditer para na primeira ocorrência válida, sem montar a lista toda
+        for match in pattern.finditer(text):
+            # O último grupo capturado é sempre o nome da marca
+            brand_candidate = match.group(match.lastindex).strip()
+            if len(brand_candidate) > 2:  # Ignora palavras muito curtas
+                return brand_candidate.title()
 
     return ""
 
 
 # backend/app/services/vision_service.py
 
+# Padrões de preço com 2 casas decimais (R$ 12,99, R$12.99, 12,99, 12.99),
+# cada um com seu peso de prioridade. O valor numérico fica no grupo 1.
+_PRICE_PATTERNS = (
+    # Peso 2: valores associados a "R$" ou "preço"
+    (re.compile(r'(?:R\$\s*|preço[:\s]*)\s*(\d{1,5}[,.]\d{2})\b'), 2),
+    # Peso 1: qualquer número no formato X,XX ou X.XX
+    (re.compile(r'\b(\d{1,5}[,.]\d{2})\b'), 1),
+)
+
+
 def extract_price_from_text(text: str) -> Optional[float]:
     """
     Extrai o preço mais provável do texto, priorizando valores associados a 'R$'.
@@ -225,28 +348,16 @@ def extract_price_from_text(text: str) -> Optional[float]:
     if not text:
         return None
 
-    # Padrões mais abrangentes para capturar números com 2 casas decimais
-    # Formatos: R$ 12,99, R$12.99, 12,99, 12.99
-    # O regex captura o valor numérico em um grupo
-    price_patterns = [
-        # Prioriza com R$ ou "preço"
-        r'(?:R\$\s*|preço[:\s]*)\s*(\d{1,5}[,.]\d{2})\b',
-        # Busca qualquer número no formato X,XX ou X.XX
-        r'\b(\d{1,5}[,.]\d{2})\b'
-    ]
-
     candidates = []
-    for pattern in price_patterns:
-        matches = re.findall(pattern, text)
+    for pattern, priority in _PRICE_PATTERNS:
+        matches = pattern.findall(text)
         for match in matches:
             # Limpa e converte para float
             price_str = match.replace(',', '.')
             try:
                 price = float(price_str)
                 if price > 0:
-                    # Adiciona o preço e um peso de prioridade
-                    # Peso 2 para padrões com 'R$' ou 'preço', peso 1 para os outros
-                    priority = 2 if 'R$' in pattern or 'preço' in pattern else 1
+                    # Adiciona o preço e o peso de prioridade do padrão
                     candidates.append({'price': price, 'priority': priority})
             except (ValueError, IndexError):
                 continue
@@ -273,29 +384,12 @@ def detect_category(text: str, labels: List) -> str:
     """
     text_lower = text.lower()
 
-    # Mapeamento de palavras-chave para categorias
-    category_keywords = {
-        'Alimentos': ['arroz', 'feijão', 'macarrão', 'óleo', 'açúcar', 'farinha', 'leite', 'café', 'comida', 'alimento'],
-        'Bebidas': ['refrigerante', 'cerveja', 'suco', 'água', 'vinho', 'whisky', 'vodka', 'bebida', 'drink'],
-        'Limpeza': ['sabão', 'detergente', 'desinfetante', 'álcool', 'água sanitária', 'amaciante', 'limpeza'],
-        'Higiene': ['shampoo', 'condicionador', 'sabonete', 'pasta de dente', 'papel higiênico', 'higiene'],
-        'Eletrônicos': ['celular', 'tv', 'notebook', 'tablet', 'fone de ouvido', 'câmera', 'eletrônico'],
-        'Vestuário': ['camisa', 'calça', 'vestido', 'roupa', 'moda', 'vestuário'],
-        'Automotivo': ['carro', 'motor', 'óleo motor', 'pneu', 'automotivo'],
-        'Construção': ['cimento', 'tijolo', 'ferro', 'construção', 'obra'],
-    }
-
     # Primeiro verifica os labels da Vision API
     for label in labels:
         if label.get('score', 0) > 0.8:
-            label_desc = label['description'].lower()
-            for category, keywords in category_keywords.items():
-                if any(keyword in label_desc for keyword in keywords):
-                    return category
+            category = _match_category(label['description'].lower())
+            if category:
+                return category
 
     # Depois verifica no texto
-    for category, keywords in category_keywords.items():
-        if any(keyword in text_lower for keyword in keywords):
-            return category
-
-    return None  # Retorna None em vez de string vazia
\ No newline at end of file
+    return _match_category(text_lower)  # None em vez de string vazia
\ No newline at end of file
@@ -1,29 +1,66 @@
 # backend/app/utils.py
 
+import hashlib
 import re
 
+# BLAKE3 é bem mais rápido que MD5 em imagens grandes, mas é opcional:
+# sem o pacote instalado, as chaves continuam sendo geradas com MD5.
+try:
+    from blake3 import blake3 as _blake3
+except ImportError:
+    _blake3 = None
+
+# Tabela de remoção de acentos do português, montada uma única vez
+_ACCENT_TABLE = str.maketrans(
+    "áàãâäéèêëíìîïóòõôöúùûüçÁÀÃÂÄÉÈÊËÍÌÎÏÓÒÕÔÖÚÙÛÜÇ",
+    "aaaaaeeeeiiiiooooouuuucAAAAAEEEEIIIIOOOOOUUUUC"
+)
+
+
+def fold_accents(text: str) -> str:
+    """Remove acentos e cedilha ("Eletrônicos" -> "Eletronicos") em uma passada."""
+    return text.translate(_ACCENT_TABLE)
+
+
+# Comprimentos válidos de GTIN (GTIN-8, UPC-A/GTIN-12, EAN-13/GTIN-13, GTIN-14)
+_GTIN_LENGTHS = frozenset((8, 12, 13, 14))
+
+# Pesos do corpo de um GTIN-14 (da esquerda para a direita). Códigos menores
+# são completados com zeros à esquerda, que não alteram a soma ponderada.
+_GTIN_WEIGHTS = (3, 1) * 6 + (3,)
+_ZERO = ord('0')
+
+
 def validate_gtin(gtin: str) -> bool:
     """
     Valida um código GTIN usando o algoritmo de dígito verificador.
     Função movida para cá para evitar dependências circulares.
     """
-    if not gtin or not isinstance(gtin, str) or not gtin.isdigit():
+    if not gtin or not isinstance(gtin, str) or not (gtin.isascii() and gtin.isdigit()):
         return False
-    
-    if len(gtin) not in [8, 12, 13, 14]:
+
+    if len(gtin) not in _GTIN_LENGTHS:
         return False
-    
-    # Converte a string de dígitos para uma lista de inteiros
-    digits = [int(d) for d in gtin]
-    
-    # Pega o dígito verificador e o corpo do código
-    check_digit = digits[-1]
-    body = digits[:-1]
-    
-    # Soma ponderada dos dígitos (da direita para a esquerda)
-    weighted_sum = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
-    
+
+    digits = gtin.zfill(14).encode()
+
+    # Soma ponderada do corpo com pesos pré-calculados
+    weighted_sum = sum(weight * (digit - _ZERO)
+                       for weight, digit in zip(_GTIN_WEIGHTS, digits))
+
     # Calcula o dígito verificador esperado
     expected_check_digit = (10 - (weighted_sum % 10)) % 10
-    
-    return check_digit == expected_check_digit
\ No newline at end of file
+
+    return digits[13] - _ZERO == expected_check_digit
+
+
+def content_hash(data: bytes) -> str:
+    """
+    Hash hexadecimal de 32 caracteres do conteúdo, apenas para chaves de cache
+    (BLAKE3 quando disponível, MD5 caso contrário). O algoritmo varia com o
+    ambiente, então o valor não deve ser persistido como identificador; para
+    isso use `vision_service.get_cache_key`.
+    """
+    if _blake3 is not None:
+        return _blake3(data).hexdigest(length=16)
+    return hashlib.md5(data).hexdigest()
@@ -1,6 +1,7 @@
 # backend/main.py
 
 # --- Imports da Biblioteca Padrão ---
+import asyncio
 import logging
 import sqlite3
 import time
@@ -8,7 +9,8 @@ import io
 import json
 from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import Optional, Union
+from functools import partial
+from typing import List, Optional, Union
 
 # --- Imports de Terceiros ---
 import pandas as pd
@@ -16,6 +18,7 @@ from fastapi import (
     Depends, FastAPI, File, HTTPException, UploadFile,
     Query, BackgroundTasks, Form
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -71,6 +74,17 @@ app.add_middleware(GZipMiddleware, minimum_size=1000)
 # --- Constantes da API ---
 API_PREFIX = "/api/v1"
 
+
+async def run_in_analysis_executor(func, **kwargs):
+    """
+    Executa a análise no executor dedicado do product_service, e não no
+    threadpool compartilhado: as esperas pela cota do Gemini não podem
+    bloquear as threads usadas pelas demais rotas (ex.: Depends(get_db)).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        product_service.ANALYSIS_EXECUTOR, partial(func, **kwargs))
+
 # =============================================================================
 # === ENDPOINTS DA APLICAÇÃO ==================================================
 # =============================================================================
@@ -122,7 +136,10 @@ async def identify_image(
     # 3. Extrai dados textuais APENAS da imagem da etiqueta
     log_structured_event(
         "vision/identify", "text_extraction_start", {"hash": tag_image_hash})
-    vision_data = vision_service.extract_vision_data(tag_image_bytes)
+    # As chamadas às APIs externas são bloqueantes: rodam no threadpool para
+    # não travar o event loop enquanto aguardam a rede.
+    vision_data = await run_in_threadpool(
+        vision_service.extract_vision_data, tag_image_bytes)
     if not vision_data.get("success"):
         raise HTTPException(
             status_code=422, detail="Não foi possível extrair dados legíveis da etiqueta.")
@@ -131,7 +148,8 @@ async def identify_image(
     log_structured_event(
         "vision/identify", "intelligent_analysis_start", {"vertical": vertical})
     try:
-        product_info = product_service.intelligent_text_analysis(
+        product_info = await run_in_analysis_executor(
+            product_service.intelligent_text_analysis,
             vision_data=vision_data,
             # Passa a imagem do produto para a busca visual
             product_image_bytes=product_image_bytes,
@@ -176,6 +194,114 @@ async def identify_image(
         confidence=identified_product.confidence,
         processing_time=processing_time
     )
+
+
+# Limite de etiquetas por requisição em lote, cada uma com até 10MB
+MAX_BATCH_IMAGES = 32
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+
+@app.post(
+    f"{API_PREFIX}/vision/identify/batch",
+    response_model=List[models.IdentificationResult],
+    summary="Identifica vários produtos a partir das imagens das etiquetas",
+    tags=["Visão Computacional"]
+)
+async def identify_images_batch(
+    background_tasks: BackgroundTasks,
+    db: sqlite3.Connection = Depends(database.get_db),
+    vertical: str = Form(...),
+    tag_images: List[UploadFile] = File(
+        ..., description="Imagens das etiquetas para extração de texto (OCR).")
+):
+    """
+    Versão em lote de /vision/identify (somente OCR, sem busca visual): o
+    Vision, a IA e o Cosmos são chamados em lote em vez de uma vez por imagem.
+    Os resultados voltam na mesma ordem dos arquivos enviados.
+    """
+    if len(tag_images) > MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=400, detail=f"Envie no máximo {MAX_BATCH_IMAGES} imagens por lote.")
+    log_structured_event("vision/identify_batch", "process_started", {
+        "vertical": vertical, "batch_size": len(tag_images)})
+
+    # O limite é verificado a cada leitura: um arquivo grande demais é
+    # recusado sem carregar o restante do lote na memória
+    images_bytes = []
+    for tag_image in tag_images:
+        image_bytes = await tag_image.read(MAX_IMAGE_SIZE + 1)
+        if not image_bytes or len(image_bytes) > MAX_IMAGE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Imagem '{tag_image.filename}' é inválida ou maior que 10MB.")
+        images_bytes.append(image_bytes)
+    image_hashes = [vision_service.get_cache_key(image_bytes)
+                    for image_bytes in images_bytes]
+
+    vision_data_list = await run_in_threadpool(
+        vision_service.extract_vision_data_batch, images_bytes)
+
+    # Só as etiquetas com dados legíveis seguem para a análise
+    readable = [index for index, vision_data in enumerate(vision_data_list)
+                if vision_data.get("success")]
+    try:
+        products_info = await run_in_analysis_executor(
+            product_service.intelligent_text_analysis_batch,
+            vision_data_list=[vision_data_list[index] for index in readable],
+            db=db,
+            vertical=vertical
+        )
+    except Exception as e:
+        logger.error(f"Erro na análise inteligente em lote: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"Erro na análise dos produtos: {e}")
+
+    results = [models.IdentificationResult(
+        success=False, status="failed", image_hash=image_hash,
+        error_message="Não foi possível extrair dados legíveis da etiqueta.")
+        for image_hash in image_hashes]
+
+    for index, product_info in zip(readable, products_info):
+        processing_time = product_info.get("metadata", {}).get("processing_time_seconds")
+        # Um item com dados inválidos (ex.: NCM mal formatado) falha sozinho,
+        # sem descartar o restante do lote, já pago em chamadas às APIs
+        try:
+            identified_product = models.IdentifiedProduct(**product_info.get("base_data", {}))
+        except Exception as e:
+            logger.warning(f"Item {index} do lote com dados inválidos: {e}")
+            error_message = f"Dados do produto inválidos: {e}"
+            results[index] = models.IdentificationResult(
+                success=False, status="failed", image_hash=image_hashes[index],
+                raw_text=vision_data_list[index].get('raw_text', ''),
+                processing_time=processing_time, error_message=error_message)
+            background_tasks.add_task(
+                database.log_processing,
+                image_hash=image_hashes[index],
+                processing_time=processing_time,
+                success=False,
+                error_message=error_message
+            )
+            continue
+
+        background_tasks.add_task(
+            database.log_processing,
+            image_hash=image_hashes[index],
+            processing_time=processing_time,
+            success=True,
+            confidence=identified_product.confidence,
+            error_message=None
+        )
+        results[index] = models.IdentificationResult(
+            success=True,
+            status="newly_identified",
+            product=identified_product,
+            image_hash=image_hashes[index],
+            raw_text=vision_data_list[index].get('raw_text', ''),
+            confidence=identified_product.confidence,
+            processing_time=processing_time
+        )
+
+    return results
 # =============================================================================
 # === ENDPOINTS DE GERENCIAMENTO DE PRODUTOS (CRUD) ===========================
 # =============================================================================
@@ -199,15 +325,16 @@ async def get_products(
     """Retorna uma lista paginada de produtos com opções de filtro e ordenação."""
     # A lógica interna para esta rota já estava robusta e foi mantida.
     params = {}
-    query = "SELECT * FROM products WHERE 1=1"
+    conditions = []
     if category:
-        query += " AND category = :category"
+        conditions.append("category = :category")
         params['category'] = category
     if brand:
-        query += " AND brand LIKE :brand"
+        conditions.append("brand LIKE :brand")
         params['brand'] = f"%{brand}%"
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-    count_query = query.replace("SELECT *", "SELECT COUNT(*)")
+    count_query = f"SELECT COUNT(*) FROM products {where_clause}"
     total = db.execute(count_query, params).fetchone()[0] or 0
 
     sort_options = {
@@ -217,7 +344,7 @@ async def get_products(
     order_clause = sort_options.get(sort, "ORDER BY id DESC")
 
     offset = (page - 1) * size
-    query += f" {order_clause} LIMIT :size OFFSET :offset"
+    query = f"SELECT * FROM products {where_clause} {order_clause} LIMIT :size OFFSET :offset"
     params['size'] = size
     params['offset'] = offset
 
@@ -309,12 +436,12 @@ async def catalog_product_visual(sku: str, title: str, vertical: str, image_byte
     """
 
     logger.info(f"Iniciando processo de embedding para SKU {sku}")
-    embedding = get_image_embedding(image_bytes)
+    embedding = await run_in_threadpool(get_image_embedding, image_bytes)
 
     if embedding:
         logger.info(
             f"Embedding gerado. Adicionando ao índice da Vector Search.")
-        add_image_to_index(sku, embedding)
+        await run_in_threadpool(add_image_to_index, sku, embedding)
     else:
         logger.error(
             f"Falha ao gerar embedding para o SKU {sku}. Catalogação visual cancelada.")